@@ -0,0 +1,56 @@
+import sys
+import time
+from os.path import join
+from pathlib import Path
+
+from hydra import initialize, compose
+from loguru import logger
+
+from feature.method_extraction import MethodContentExtraction, QueryMethodContentExtraction
+
+
+def time_extraction(extractor: MethodContentExtraction, files):
+    """
+    Extracts the methods of the files, returning the results and the time spent in get_methods.
+    Files on which get_methods raises are recorded as None.
+    """
+    results = []
+    start = time.perf_counter()
+    for content in files:
+        try:
+            results.append(extractor.get_methods(content))
+        except Exception:
+            results.append(None)
+    return results, time.perf_counter() - start
+
+
+def main():
+    """
+    Compares the token based method extraction with the query based one on the Java files of the repositories, or
+    of the folder given as first argument, checking that they return the same methods.
+    """
+    with initialize(version_base=None, config_path="../../src/conf/"):
+        cfg = compose(config_name='annotation.yaml')
+
+    folder = sys.argv[1] if len(sys.argv) > 1 else join(cfg.base_path, 'data', 'raw', 'repositories')
+    max_files = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    paths = sorted(Path(folder).rglob('*.java'))[:max_files]
+    files = [path.read_bytes() for path in paths]
+    logger.info(f"Loaded {len(files)} files ({sum(len(x) for x in files) / 1024 / 1024:.1f}MB) from {folder}")
+
+    token_results, token_time = time_extraction(MethodContentExtraction(), files)
+    query_results, query_time = time_extraction(QueryMethodContentExtraction(), files)
+
+    failed = [path for path, res in zip(paths, token_results) if res is None]
+    different = [path for path, a, b in zip(paths, token_results, query_results) if a is not None and a != b]
+
+    logger.info(f"Token based: {token_time:.2f}s, query based: {query_time:.2f}s, "
+                f"speedup: {token_time / query_time if query_time else float('inf'):.1f}x")
+    logger.info(f"Files failing with the token based extraction: {len(failed)}")
+    logger.info(f"Files with different methods: {len(different)}")
+    for path in different[:10]:
+        logger.warning(f"Different methods in {path}")
+
+
+if __name__ == '__main__':
+    main()
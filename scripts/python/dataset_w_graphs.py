@@ -1,18 +1,23 @@
+from functools import partial
+from multiprocessing import Pool
 from os.path import join
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
 
 import pandas as pd
 from hydra import initialize, compose
 from loguru import logger
 from tqdm import tqdm
 
-from data.graph import ArcanGraphLoader
+from data.graph import ArcanGraphLoader, graph_stats
+from data.manifest import VersionManifest
 
 
 def load_arcan_graphs_path(cfg) -> List[Path]:
-    arcan_path_project = Path(join(cfg.arcan_out, 'arcanOutput/'))
-    projects = list(arcan_path_project.glob('**/*.graphml'))
+    VersionManifest.configure(cfg.get('manifest_dir'))
+    manifest = VersionManifest.get(join(cfg.arcan_out, 'arcanOutput'))
+    manifest.refresh()
+    projects = [Path(path) for _, _, _, path in manifest.graphs()]
 
     return projects
 
@@ -26,20 +31,38 @@ def load_labels(cfg) -> Tuple[Dict[str, List[str]], Dict[str, List[str]]]:
     return label_mapping, level_mapping
 
 
-def load_arcan_graphs(arcan_graphs_paths: List[Path]) -> Tuple[List[Tuple[str, str, str, int, int]], int]:
-    loader = ArcanGraphLoader()
-    graphs = []
-    skipped = 0
-    for project_path in tqdm(arcan_graphs_paths):
-        try:
-            project = loader.load(str(project_path))
+def load_arcan_graph(project_path: Path, fast: bool = True) -> Optional[Tuple[str, str, str, int, int]]:
+    """
+    Returns the size of a graph. In fast mode the vertices and edges are counted without building the graph.
+    :param project_path: Path of the GraphML file
+    :param fast: Whether to use the header-only statistics
+    :return: (name, version, sha, nodes, edges), or None if the graph cannot be read
+    """
+    try:
+        if fast:
+            nodes, edges = graph_stats(str(project_path))
+        else:
+            project = ArcanGraphLoader().load(str(project_path))
             nodes = len(project.vs)
             edges = len(project.es)
-            name = project_path.parent.name
-            ver, sha = project_path.stem.replace('dependency-graph-', '').split('_')
-            graphs.append((name, ver, sha, nodes, edges))
-        except Exception as _:
-            skipped += 1
+        name = project_path.parent.name
+        ver, sha = project_path.stem.replace('dependency-graph-', '').split('_')
+        return name, ver, sha, nodes, edges
+    except Exception as _:
+        return None
+
+
+def load_arcan_graphs(arcan_graphs_paths: List[Path], num_workers: int = 1,
+                      fast: bool = True) -> Tuple[List[Tuple[str, str, str, int, int]], int]:
+    load = partial(load_arcan_graph, fast=fast)
+    if num_workers > 1:
+        with Pool(num_workers) as p:
+            results = list(tqdm(p.imap(load, arcan_graphs_paths, chunksize=16), total=len(arcan_graphs_paths)))
+    else:
+        results = [load(project_path) for project_path in tqdm(arcan_graphs_paths)]
+
+    graphs = [x for x in results if x is not None]
+    skipped = len(results) - len(graphs)
 
     return graphs, skipped
 
@@ -67,7 +90,7 @@ def main():
         cfg = compose(config_name='main.yaml', overrides=["local=default"])
 
     arcan_graphs_paths = load_arcan_graphs_path(cfg)
-    arcan_graphs, skipped = load_arcan_graphs(arcan_graphs_paths)
+    arcan_graphs, skipped = load_arcan_graphs(arcan_graphs_paths, cfg.num_workers)
 
     logger.info(f"Skipped {skipped} projects")
 
@@ -5,7 +5,7 @@ import numpy as np
 import pandas
 from hydra import initialize, compose
 
-from data.graph import ArcanGraphLoader
+from data.graph import ArcanGraphLoader, GraphView
 
 
 def projects_level_labels(annotations_path):
@@ -19,12 +19,14 @@ def projects_level_labels(annotations_path):
 
 def random_node(graph):
     """
-    Return a random node from the graph with an indegree between 20 and 50
+    Return a random node from the graph with an indegree between 20 and 50, or None if there is no such node
     """
-    while True:
-        n = np.random.randint(0, len(graph.vs))
-        if graph.vs[n]['labelV'] != 'container' and 10 < igraph.Graph.indegree(graph, n) < 20:
-            return n
+    view = GraphView(graph)
+    indegree = view.degree('in')
+    candidates = np.flatnonzero((view.vertex('labelV') != 'container') & (10 < indegree) & (indegree < 20))
+    if not len(candidates):
+        return None
+    return int(np.random.choice(candidates))
 
 
 def annotate_subgraph(subgraph, node_annotations, top_k_labels, label_map):
@@ -48,12 +50,12 @@ def load_node_annotations(project_annotation_path):
 def best_node(graph, node_annotations, top_label):
     best_node = None
     best_score = 0
-    for n in graph.vs:
-        if n['filePathRelative'] in node_annotations:
-            score = node_annotations[n['filePathRelative']][top_label]
-            if best_score < score < 0.75:
-                best_score = score
-                best_node = n.index
+    paths = GraphView(graph).vertex('filePathRelative')
+    for index in np.flatnonzero(np.isin(paths, list(node_annotations))):
+        score = node_annotations[paths[index]][top_label]
+        if best_score < score < 0.75:
+            best_score = score
+            best_node = int(index)
     print(best_score)
     return best_node
 
@@ -75,6 +77,9 @@ def export_for_r():
     node_annotations = load_node_annotations(project_annotation_path)
     graph = ArcanGraphLoader(clean=True).load(project_graph_path)
     initial_node = random_node(graph)
+    if initial_node is None:
+        print(f"No node to plot in {project}")
+        return
     neighbor = graph.neighborhood([initial_node], 1)[0][0]
     subgraph_vertices = graph.neighborhood([initial_node, neighbor], 1)[0]
     subgraph = igraph.Graph.subgraph(graph, subgraph_vertices)
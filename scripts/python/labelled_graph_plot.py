@@ -12,7 +12,8 @@ import pandas as pd
 from omegaconf import DictConfig
 from tqdm import tqdm
 
-from data.graph import ArcanGraphLoader
+from data.graph import ArcanGraphLoader, CleaningProfile, clean_graph
+from data.membership import MembershipIndex
 
 warnings.filterwarnings('ignore')
 
@@ -34,24 +35,22 @@ def projects_level_labels(annotations):
     return agg
 
 
-def annotate_nodes(graph, node_annotations, top_labels, label_map, k):
+def annotate_nodes(graph, node_annotations, top_labels, label_map, k, membership):
     grouped = 0
     tot = 0
     group_map = dict()
     for n in graph.vs:
         if n['labelV'] != 'container':
             tot += 1
-            out_edges = graph.incident(n, mode="out")
-            assert len(out_edges) < 2
-            if not out_edges:
+            vertex = membership.position(n['name'])
+            target = int(membership.parent[vertex]) if vertex >= 0 else -1
+            if target < 0:
                 continue
-            out_edge = out_edges[0]
-            target_vertex = graph.vs[graph.es[out_edge].target]
-            if target_vertex['labelV'] == 'container':
-                if target_vertex.index not in group_map:
-                    group_map[target_vertex.index] = len(group_map)
+            if membership.is_container[target]:
+                if target not in group_map:
+                    group_map[target] = len(group_map)
 
-                g_id = group_map[target_vertex.index]
+                g_id = group_map[target]
                 n['group'] = str(g_id)
                 grouped += 1
 
@@ -88,19 +87,13 @@ def load_node_annotations(project_annotation_path):
 
 
 def clean_edges(graph):
-    remove = []
-    for edge in graph.es:
-        if edge['labelE'] != 'belongsTo':
-            remove.append(edge)
-
-    graph.delete_edges(remove)
+    graph, _ = clean_graph(graph, CleaningProfile('belongs_to_edges', keep_edge_labels=['belongsTo']))
 
     return graph
 
 
 def clean_nodes(graph):
-    delete = [x.index for x in graph.vs if x['labelV'] not in {'container', 'unit'}]
-    graph.delete_vertices(delete)
+    graph, _ = clean_graph(graph, CleaningProfile('package_nodes', keep_vertex_labels=['container', 'unit']))
 
     return graph
 
@@ -123,16 +116,17 @@ def add_root(graph):
     return graph
 
 
-def annotate_package(graph, package_annotations, top_labels, label_map, k):
+def annotate_package(graph, package_annotations, top_labels, label_map, k, membership):
     total = 0
     annotated = 0
     csv_rows = []
     n = 267
+    num_files = membership.num_files()
     for n in graph.vs:
         if n['labelV'] == 'container':
             total += 1
             if n['name'] in package_annotations:
-                n['num_files'] = len([1 for x in graph.incident(n, mode="in") if graph.vs[x]['labelV'] == 'unit'])
+                n['num_files'] = int(num_files[membership.position(n['name'])])
 
                 annotated += 1
                 annot = package_annotations[n['name']]['clean_distribution']
@@ -186,9 +180,9 @@ def annotate_graphml(cfg: DictConfig):
 
             project_labels = projects_level_labels(node_annotations)
             project_labels = sorted(range(len(project_labels)), key=lambda i: -project_labels[i])
-            graph = ArcanGraphLoader(clean=False).load(join(cfg.arcan_graphs, project, graph_path))
-            graph = clean_edges(graph)
-            graph = clean_nodes(graph)
+            # Same as clean_edges followed by clean_nodes
+            graph = ArcanGraphLoader(clean='belongs_to').load(join(cfg.arcan_graphs, project, graph_path))
+            membership = MembershipIndex.load_or_build(join(cfg.arcan_graphs, project, graph_path))
             # graph = add_root(graph)
 
             package_annotations = load_package_annotations(join(cfg.package_labels_path, 'annotations.json'), project)
@@ -199,9 +193,10 @@ def annotate_graphml(cfg: DictConfig):
             for k in [3, 5, 10, 20]:
                 for t in [1, k]:
                     top_k = [label_map[i] for i in project_labels[:k]]
-                    graph = annotate_nodes(graph, node_annotations, top_k, label_map, t)
+                    graph = annotate_nodes(graph, node_annotations, top_k, label_map, t, membership)
                     if package_annotations:
-                        graph, csv_rows = annotate_package(graph, package_annotations, top_k, label_map, t)
+                        graph, csv_rows = annotate_package(graph, package_annotations, top_k, label_map, t,
+                                                           membership)
                         df = pd.DataFrame(csv_rows, columns=['name', 'weight', 'label'])
                         if t == k:
                             if k == 3:
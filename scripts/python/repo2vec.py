@@ -8,6 +8,8 @@ from hydra.utils import instantiate
 from loguru import logger
 from omegaconf import DictConfig
 
+from data.diff import IncrementalState
+from data.manifest import VersionManifest
 from utils import git_clone, get_versions, git_checkout
 
 
@@ -18,6 +20,7 @@ def repo2vec(cfg: DictConfig):
     :param cfg:
     :return:
     """
+    VersionManifest.configure(cfg.get('manifest_dir'))
     embedding = instantiate(cfg.embedding.cls)
 
     extraction = instantiate(cfg.extraction.cls, model=embedding)
@@ -40,11 +43,12 @@ def repo2vec(cfg: DictConfig):
         versions = get_versions(project_name, cfg.arcan_graphs)
 
         logger.info(f"Found {len(versions)} versions for project {project}")
+        incremental = IncrementalState(result_key=extraction.result_key)
         for num, sha in versions:
             try:
-                if extraction.clone:
+                if extraction.clone and extraction.checkout:
                     git_checkout(join(cfg.repositories_path, project_name), sha)
-                extraction.extract(project_name, sha=sha, num=num)
+                extraction.extract(project_name, sha=sha, num=num, incremental=incremental)
             except Exception as e:
                 logger.error(f"Failed to extract features for {project} {num} {sha}")
                 logger.error(f"{e}")
@@ -1,6 +1,5 @@
 import json
 from abc import ABC, abstractmethod
-from collections import Counter
 from os.path import join
 from pathlib import Path
 
@@ -24,6 +23,15 @@ class Annotation(ABC):
     def annotate(self, name, content):
         pass
 
+    def annotate_all(self, contents):
+        """
+        Annotates the nodes, returning the labels vector of each node. Annotations that can process several nodes
+        at once override it.
+        :param contents: Map from node to content
+        :return:
+        """
+        return {name: self.annotate(name, content) for name, content in contents.items()}
+
     @staticmethod
     def load_keywords(keywords_dir):
         keywords_path = Path(keywords_dir, "similarity")
@@ -50,14 +58,43 @@ class Annotation(ABC):
 
 
 class KeywordAnnotation(Annotation):
+    def __init__(self, keywords_dir, annotations_path):
+        super().__init__(keywords_dir, annotations_path)
+        self.vocabulary, self.keyword_counts, self.keyword_weights = self.keyword_matrix()
 
-    def annotate(self, name, content):
-        node_labels = np.zeros(self.n)
+    def keyword_matrix(self):
+        """
+        Interns the keywords of all the labels, and returns their ids, and for each label the multiplicity and
+        the weight of each keyword, as (labels x keywords) matrices.
+        """
+        vocabulary = {}
+        for kw in self.keywords.values():
+            for k in kw.distinct_elements():
+                vocabulary.setdefault(k, len(vocabulary))
+
+        counts = np.zeros((self.n, len(vocabulary)))
+        weights = np.zeros((self.n, len(vocabulary)))
         for label, kw in self.keywords.items():
-            intersection = list(kw.intersection(Multiset(content.split())))
-            intersection = Counter(intersection)
-            node_labels[self.mapping[label]] = sum(
-                [intersection[k] * self.weights[label][k] for k in intersection.keys()])
+            for k, multiplicity in kw.items():
+                counts[self.mapping[label], vocabulary[k]] = multiplicity
+                weights[self.mapping[label], vocabulary[k]] = self.weights[label][k]
+
+        return vocabulary, counts, weights
+
+    def annotate(self, name, content):
+        """
+        Scores each label with the weighted size of the multiset intersection between its keywords and the tokens
+        of the content, computed for all the labels at once over the keyword ids.
+        :param name:
+        :param content: Content of the node, as text or as a list of tokens
+        :return:
+        """
+        tokens = content.split() if isinstance(content, str) else content
+        ids = [self.vocabulary[x] for x in tokens if x in self.vocabulary]
+        counts = np.bincount(ids, minlength=len(self.vocabulary))
+        present = np.flatnonzero(counts)
+        intersection = np.minimum(self.keyword_counts[:, present], counts[present])
+        node_labels = np.where(intersection > 0, intersection * self.keyword_weights[:, present], 0).sum(axis=1)
 
         norm = np.sum(node_labels)
         node_vec = node_labels / norm if norm > 0 else np.zeros(self.n)
@@ -66,9 +103,10 @@ class KeywordAnnotation(Annotation):
 
 
 class SemanticSimilarityAnnotation(Annotation):
-    def __init__(self, keywords_dir, annotations_path, embedding: AbstractEmbeddingModel):
+    def __init__(self, keywords_dir, annotations_path, embedding: AbstractEmbeddingModel, batch_size: int = 32):
         super().__init__(keywords_dir, annotations_path)
         self.embedding = embedding
+        self.batch_size = batch_size
         self.label_vecs = self.embed_labels()
 
     def annotate(self, name, content):
@@ -85,12 +123,28 @@ class SemanticSimilarityAnnotation(Annotation):
         node_labels = sims / norm if norm else sims
         return node_labels
 
-    def embed_labels(self):
-        res = []
-        for label in self.mapping:
-            res.append(self.embedding.get_embedding(label.lower()))
+    def annotate_all(self, contents):
+        """
+        Annotates the nodes as annotate, embedding their content in batches.
+        :param contents: Map from node to content
+        :return:
+        """
+        names = list(contents)
+        node_labels = {}
+        for start in range(0, len(names), self.batch_size):
+            batch = names[start:start + self.batch_size]
+            content_vecs = self.embedding.get_embeddings([contents[name].lower() for name in batch], self.batch_size)
+            sims = cosine_similarity(content_vecs, self.label_vecs)
+            # Same as sims[0] + abs(min(sims)) in annotate, where sims has a single row
+            sims = sims + np.abs(sims)
+            norms = np.linalg.norm(sims, axis=1, keepdims=True)
+            sims = np.divide(sims, norms, out=sims, where=norms > 0)
+            node_labels.update(zip(batch, sims))
 
-        return res
+        return node_labels
+
+    def embed_labels(self):
+        return self.embedding.get_embeddings([label.lower() for label in self.mapping], self.batch_size)
 
 
 class PrecomputedEmbeddingAnnotation(Annotation):
@@ -103,7 +157,7 @@ class PrecomputedEmbeddingAnnotation(Annotation):
         self.label_vecs = self.embed_labels()
 
     def annotate(self, name, content):
-        content_vec = content
+        content_vec = np.asarray(content, dtype=np.float64).reshape(1, -1)
 
         try:
             sims = cosine_similarity(content_vec, self.label_vecs)
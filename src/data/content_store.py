@@ -0,0 +1,396 @@
+import gzip
+import json
+import os
+import zlib
+from os.path import join, exists
+from typing import Dict, Tuple, List, Iterator, Any, Optional
+
+import numpy as np
+from loguru import logger
+
+from data.strings import pack_strings, unpack_strings
+from data.vocabulary import Vocabulary
+
+
+class ContentStore:
+    """
+    Content of the versions of the projects, stored in the content folder as one file per project with one json
+    record per version, `{"project", "num", "sha", "content"}`, as written by extract_document_content.
+    If compress is set, each record is written as a separate gzip member in `{project}.json.gz`, so the file is
+    still a valid gzip file and each record can be decompressed on its own.
+    Each file has an index, `{file}.idx`, with the offset and length of the records, so loading a version reads
+    only the bytes of its record. The index is written with the file, and built with a single scan for files that
+    do not have one. If the writer is given a vocabulary, the bag-of-words of the textual content is written with
+    the file, see BagOfWords.
+    """
+
+    index_version = 1
+
+    def __init__(self, content_dir: str, compress: bool = False):
+        """
+        :param content_dir: Content folder
+        :param compress: Whether to compress the records of the files that are written
+        """
+        self.content_dir = content_dir
+        self.compress = compress
+        self._indexes = {}
+
+    def path(self, project: str) -> str:
+        """
+        Returns the path of the content file of the project, the existing one if any.
+        :param project: Project name
+        :return:
+        """
+        plain = join(self.content_dir, f"{project}.json")
+        compressed = f"{plain}.gz"
+        if exists(plain):
+            return plain
+        return compressed if exists(compressed) or self.compress else plain
+
+    @staticmethod
+    def _file_key(path: str) -> list:
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def index(self, project: str) -> Dict[str, Tuple[str, int, int]]:
+        """
+        Returns the index of the content file of the project, building it if missing or stale.
+        :param project: Project name
+        :return: Map from sha to (num, offset, length) of the record
+        """
+        path = self.path(project)
+        key = self._file_key(path)
+        cached = self._indexes.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        index = self._read_index(path, key)
+        if index is None:
+            index = self._scan(path)
+            try:
+                self._write_index(path, index, key)
+            except OSError as e:
+                logger.warning(f"Could not save content index of {path}: {e}")
+
+        self._indexes[path] = (key, index)
+        return index
+
+    def _read_index(self, path: str, key: list) -> Optional[Dict[str, Tuple[str, int, int]]]:
+        try:
+            with open(f"{path}.idx", 'rt') as inf:
+                data = json.load(inf)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != self.index_version or data.get('key') != key:
+            return None
+        return {sha: (num, offset, length) for num, sha, offset, length in data['entries']}
+
+    @classmethod
+    def _write_index(cls, path: str, index: Dict[str, Tuple[str, int, int]], key: list) -> None:
+        entries = [[num, sha, offset, length] for sha, (num, offset, length) in index.items()]
+        tmp = f"{path}.idx.tmp-{os.getpid()}"
+        with open(tmp, 'wt') as outf:
+            json.dump({'version': cls.index_version, 'key': key, 'entries': entries}, outf)
+        os.replace(tmp, f"{path}.idx")
+
+    def _scan(self, path: str) -> Dict[str, Tuple[str, int, int]]:
+        """
+        Builds the index of a content file by reading all its records.
+        """
+        index = {}
+        for offset, length, record in self._scan_records(path):
+            index[record['sha']] = (record['num'], offset, length)
+        logger.info(f"Indexed {len(index)} versions in {path}")
+        return index
+
+    @staticmethod
+    def _scan_records(path: str) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+        if not path.endswith('.gz'):
+            offset = 0
+            with open(path, 'rb') as inf:
+                for line in inf:
+                    if line.strip():
+                        yield offset, len(line), json.loads(line)
+                    offset += len(line)
+            return
+
+        # The gzip members are decompressed as the file is streamed, the bytes following the end of a member are
+        # fed to the decompressor of the next one
+        offset, consumed = 0, 0
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        lines = []
+        with open(path, 'rb') as inf:
+            chunk = inf.read(1 << 20)
+            while chunk:
+                lines.append(decompressor.decompress(chunk))
+                if not decompressor.eof:
+                    consumed += len(chunk)
+                    chunk = inf.read(1 << 20)
+                    continue
+
+                length = consumed + len(chunk) - len(decompressor.unused_data)
+                for line in b''.join(lines).splitlines():
+                    if line.strip():
+                        yield offset, length, json.loads(line)
+                offset += length
+                chunk = decompressor.unused_data or inf.read(1 << 20)
+                consumed = 0
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                lines = []
+
+        # Truncated last member
+        for line in b''.join(lines).splitlines():
+            if line.strip():
+                yield offset, consumed, json.loads(line)
+
+    def versions(self, project: str) -> List[Tuple[str, str]]:
+        """
+        Returns the (num, sha) versions in the content file of the project, in the order they were written.
+        :param project: Project name
+        :return:
+        """
+        index = self.index(project)
+        return [(num, sha) for sha, (num, _, _) in sorted(index.items(), key=lambda x: x[1][1])]
+
+    def record(self, project: str, sha: str, num: str = None) -> Dict[str, Any]:
+        """
+        Loads the record of a version, reading only its bytes.
+        :param project: Project name
+        :param sha: SHA of the version
+        :param num: Number of the version, checked if given
+        :return:
+        """
+        entry = self.index(project).get(sha)
+        if entry is None or (num is not None and str(entry[0]) != str(num)):
+            raise KeyError(f"Could not find {sha} in {project}")
+
+        path = self.path(project)
+        _, offset, length = entry
+        with open(path, 'rb') as inf:
+            inf.seek(offset)
+            data = inf.read(length)
+        if path.endswith('.gz'):
+            data = gzip.decompress(data)
+        return json.loads(data)
+
+    def load(self, project: str, sha: str, num: str = None) -> Dict[str, Any]:
+        """
+        Loads the content of the nodes of a version.
+        :param project: Project name
+        :param sha: SHA of the version
+        :param num: Number of the version, checked if given
+        :return: Map from node to content
+        """
+        return self.record(project, sha, num)['content']
+
+    def skipped(self, project: str, sha: str, num: str = None) -> Dict[str, str]:
+        """
+        Loads the files of a version whose content was not extracted, see SourceFilter.
+        :param project: Project name
+        :param sha: SHA of the version
+        :param num: Number of the version, checked if given
+        :return: Map from file path to the reason it was skipped or truncated
+        """
+        return self.record(project, sha, num).get('skipped', {})
+
+    def nodes(self, project: str, sha: str, num: str = None) -> Iterator[Tuple[str, Any]]:
+        """
+        Iterates over the (node, content) of a version.
+        """
+        yield from self.load(project, sha, num).items()
+
+    def records(self, project: str) -> Iterator[Dict[str, Any]]:
+        """
+        Iterates over the records of all the versions of the project, reading the file sequentially.
+        :param project: Project name
+        :return:
+        """
+        for _, _, record in self._scan_records(self.path(project)):
+            yield record
+
+    def bow_path(self, project: str) -> str:
+        """
+        Returns the path of the bag-of-words of the project, see BagOfWords.
+        """
+        return join(self.content_dir, f"{project}.bow.npz")
+
+    def bag_of_words(self, project: str) -> Optional['BagOfWords']:
+        """
+        Loads the bag-of-words of the textual content of the project.
+        :param project: Project name
+        :return: The bag-of-words, or None if missing or older than the content file
+        """
+        path = self.bow_path(project)
+        if not exists(path) or not exists(self.path(project)):
+            return None
+        bow = BagOfWords.load(path)
+        return bow if bow.key == self._file_key(self.path(project)) else None
+
+    def writer(self, project: str, vocabulary: Vocabulary = None) -> 'ContentWriter':
+        """
+        Returns a writer replacing the content file of the project once all the versions are written.
+        :param project: Project name
+        :param vocabulary: If given, the bag-of-words of the textual content is written with the file
+        :return:
+        """
+        plain = join(self.content_dir, f"{project}.json")
+        path = f"{plain}.gz" if self.compress else plain
+        return ContentWriter(self, path, plain if self.compress else f"{plain}.gz", self.bow_path(project),
+                             vocabulary)
+
+
+class ContentWriter:
+    """
+    Writes the records of a content file and its index to temporary files, moved to their final path when the
+    writer is closed without errors.
+    """
+
+    def __init__(self, store: ContentStore, path: str, other: str, bow_path: str, vocabulary: Vocabulary = None):
+        """
+        :param store: Store of the file
+        :param path: Path of the content file
+        :param other: Path of the file in the other format, removed when the file is written
+        :param bow_path: Path of the bag-of-words of the file
+        :param vocabulary: Vocabulary used to write the bag-of-words, if None it is not written
+        """
+        self.store = store
+        self.path = path
+        self.other = other
+        self.bow_path = bow_path
+        self.vocabulary = vocabulary
+        self.tmp = f"{path}.tmp-{os.getpid()}"
+        self.file = None
+        self.index = {}
+        self.bow = BagOfWords.builder()
+
+    def __enter__(self):
+        self.file = open(self.tmp, 'wb')
+        return self
+
+    def write(self, project: str, num: str, sha: str, content: Dict[str, Any], skipped: Dict[str, str] = None) -> None:
+        """
+        Writes the content of a version.
+        :param project: Project name, as stored in the record
+        :param num: Number of the version
+        :param sha: SHA of the version
+        :param content: Map from node to content
+        :param skipped: Map from file path to the reason its content was skipped or truncated, if any
+        :return:
+        """
+        record = {"project": project, "num": num, "sha": sha, "content": content}
+        if skipped:
+            record["skipped"] = skipped
+        row = json.dumps(record, ensure_ascii=False)
+        data = (row + os.linesep).encode("utf8")
+        if self.path.endswith('.gz'):
+            data = gzip.compress(data)
+        self.index[sha] = (num, self.file.tell(), len(data))
+        self.file.write(data)
+
+        if self.vocabulary is not None:
+            texts = {node: text for node, text in content.items() if isinstance(text, str)}
+            ids = self.vocabulary.encode_all(list(texts.values()))
+            self.bow.add(sha, {node: Vocabulary.bag_of_words(x) for node, x in zip(texts, ids)})
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.file.close()
+        if exc_type is not None:
+            os.remove(self.tmp)
+            return
+
+        os.replace(self.tmp, self.path)
+        for path in (self.other, f"{self.other}.idx", self.bow_path):
+            if exists(path):
+                os.remove(path)
+        key = self.store._file_key(self.path)
+        self.store._write_index(self.path, self.index, key)
+        if self.vocabulary is not None:
+            self.bow.build(key).save(self.bow_path)
+
+
+class BagOfWords:
+    """
+    Bag-of-words of the textual content of the versions of a project, as ids of the corpus vocabulary and their
+    counts. Stored as an npz archive of flat arrays: the nodes of version i are nodes[version_indptr[i]:
+    version_indptr[i + 1]], and the ids and counts of node j are ids[node_indptr[j]:node_indptr[j + 1]].
+    """
+
+    def __init__(self, shas: List[str], version_indptr: np.ndarray, nodes: List[str], node_indptr: np.ndarray,
+                 ids: np.ndarray, counts: np.ndarray, key: list = None):
+        self.shas = shas
+        self.version_indptr = version_indptr
+        self.nodes = nodes
+        self.node_indptr = node_indptr
+        self.ids = ids
+        self.counts = counts
+        self.key = key
+
+    @staticmethod
+    def builder() -> '_BagOfWordsBuilder':
+        return _BagOfWordsBuilder()
+
+    def version(self, sha: str) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Returns the ids and counts of each node of a version.
+        :param sha: SHA of the version
+        :return:
+        """
+        i = self.shas.index(sha)
+        res = {}
+        for j in range(self.version_indptr[i], self.version_indptr[i + 1]):
+            start, end = self.node_indptr[j], self.node_indptr[j + 1]
+            res[self.nodes[j]] = (self.ids[start:end], self.counts[start:end])
+        return res
+
+    def term_counts(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the distinct ids in all the versions and their total counts.
+        """
+        ids, inverse = np.unique(self.ids, return_inverse=True)
+        return ids, np.bincount(inverse, weights=self.counts, minlength=len(ids)).astype(np.int64)
+
+    def save(self, path: str) -> None:
+        shas_data, shas_offsets = pack_strings(self.shas)
+        nodes_data, nodes_offsets = pack_strings(self.nodes)
+        tmp = f"{path}.tmp-{os.getpid()}.npz"
+        np.savez(tmp, shas_data=shas_data, shas_offsets=shas_offsets, version_indptr=self.version_indptr,
+                 nodes_data=nodes_data, nodes_offsets=nodes_offsets, node_indptr=self.node_indptr,
+                 ids=self.ids, counts=self.counts, key=np.array(json.dumps(self.key)))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'BagOfWords':
+        with np.load(path) as data:
+            return cls(unpack_strings(data['shas_data'], data['shas_offsets']), data['version_indptr'],
+                       unpack_strings(data['nodes_data'], data['nodes_offsets']), data['node_indptr'],
+                       data['ids'], data['counts'], json.loads(str(data['key'])))
+
+
+class _BagOfWordsBuilder:
+    def __init__(self):
+        self.shas = []
+        self.nodes = []
+        self.version_sizes = []
+        self.node_sizes = []
+        self.ids = []
+        self.counts = []
+
+    def add(self, sha: str, content: Dict[str, Tuple[np.ndarray, np.ndarray]]) -> None:
+        self.shas.append(sha)
+        self.version_sizes.append(len(content))
+        for node, (ids, counts) in content.items():
+            self.nodes.append(node)
+            self.node_sizes.append(len(ids))
+            self.ids.append(ids)
+            self.counts.append(counts)
+
+    def build(self, key: list = None) -> BagOfWords:
+        return BagOfWords(self.shas, _indptr(self.version_sizes), self.nodes, _indptr(self.node_sizes),
+                          np.concatenate(self.ids) if self.ids else np.zeros(0, dtype=np.int32),
+                          np.concatenate(self.counts) if self.counts else np.zeros(0, dtype=np.int32), key)
+
+
+def _indptr(sizes: List[int]) -> np.ndarray:
+    indptr = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(np.array(sizes, dtype=np.int64), out=indptr[1:])
+    return indptr
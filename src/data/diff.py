@@ -0,0 +1,171 @@
+import hashlib
+from collections import defaultdict
+from typing import Dict, Optional, Iterable, Tuple, Any, List
+
+import igraph
+import numpy as np
+
+from data.graph import GraphView
+
+
+class VersionDiff:
+    """
+    Differences between two versions of a project graph. Nodes are matched by key (the relative file path by
+    default) and compared by signature, see node_signatures.
+    """
+
+    def __init__(self, added: set, removed: set, changed: set, unchanged: set):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+        self.unchanged = unchanged
+
+    @property
+    def recompute(self) -> set:
+        """
+        Keys of the nodes whose results have to be computed again.
+        """
+        return self.added | self.changed
+
+    def __str__(self):
+        return (f"added: {len(self.added)}, removed: {len(self.removed)}, changed: {len(self.changed)}, "
+                f"unchanged: {len(self.unchanged)}")
+
+
+def node_signatures(graph: igraph.Graph, hashes: Dict[str, str] = None,
+                    key: str = 'filePathRelative') -> Dict[str, Tuple]:
+    """
+    Computes a signature for each node of the graph. If the blob hashes of the files are available, the signature
+    of a file is its hash. Otherwise, and for nodes without a file, the signature is built from the node name and
+    label and from the names of its out-neighbours, so a node is considered changed when its dependencies change.
+    :param graph: Graph of the version
+    :param hashes: Map from relative file path to git blob hash
+    :param key: Vertex attribute used to match the nodes between versions
+    :return:
+    """
+    view = GraphView(graph)
+    keys = view.vertex(key).tolist()
+    names = view.vertex('name').tolist()
+    labels = view.vertex('labelV').tolist()
+    indptr, indices, _ = view.csr('out')
+
+    signatures = defaultdict(list)
+    for vertex, node in enumerate(keys):
+        if hashes and node in hashes:
+            signature = hashes[node]
+        else:
+            neighbors = sorted(names[x] for x in indices[indptr[vertex]:indptr[vertex + 1]].tolist())
+            signature = hashlib.sha1("\0".join([names[vertex], labels[vertex]] + neighbors).encode("utf8")).hexdigest()
+        signatures[node].append(signature)
+
+    return {node: tuple(sorted(signature)) for node, signature in signatures.items()}
+
+
+def diff_signatures(old: Dict[str, Tuple], new: Dict[str, Tuple]) -> VersionDiff:
+    """
+    Compares the node signatures of two versions.
+    """
+    added = set(new) - set(old)
+    removed = set(old) - set(new)
+    common = set(new) & set(old)
+    changed = {x for x in common if old[x] != new[x]}
+    return VersionDiff(added, removed, changed, common - changed)
+
+
+def diff_graphs(old: igraph.Graph, new: igraph.Graph, old_hashes: Dict[str, str] = None,
+                new_hashes: Dict[str, str] = None, key: str = 'filePathRelative') -> VersionDiff:
+    """
+    Compares two versions of a project graph.
+    :param old: Graph of the previous version
+    :param new: Graph of the current version
+    :param old_hashes: Blob hashes of the files in the previous version
+    :param new_hashes: Blob hashes of the files in the current version
+    :param key: Vertex attribute used to match the nodes between versions
+    :return:
+    """
+    return diff_signatures(node_signatures(old, old_hashes, key), node_signatures(new, new_hashes, key))
+
+
+class IncrementalState:
+    """
+    Results of the previous version of a project, used to compute the next version incrementally. For each version:
+    call diff to get the nodes to recompute, compute the results only for those nodes (see subgraph), and call
+    carry_forward to merge them with the results of the unchanged nodes.
+    """
+
+    def __init__(self, key: str = 'filePathRelative', result_key: str = 'filePathRelative'):
+        """
+        :param key: Vertex attribute used to match the nodes between versions
+        :param result_key: Vertex attribute used as key of the results
+        """
+        self.key = key
+        self.result_key = result_key
+        self.signatures = {}
+        self.results = {}
+        self._pending = None
+
+    def diff(self, graph: igraph.Graph, hashes: Dict[str, str] = None) -> VersionDiff:
+        """
+        Compares the graph with the previous version.
+        :param graph: Graph of the current version
+        :param hashes: Blob hashes of the files in the current version
+        :return:
+        """
+        signatures = node_signatures(graph, hashes, self.key)
+        diff = diff_signatures(self.signatures, signatures)
+        self._pending = (graph, signatures, diff)
+        return diff
+
+    def subgraph(self, graph: igraph.Graph, diff: VersionDiff) -> igraph.Graph:
+        """
+        Returns the subgraph induced by the nodes to recompute.
+        """
+        keys = GraphView(graph).vertex(self.key)
+        return graph.induced_subgraph(np.flatnonzero(np.isin(keys, list(diff.recompute))).tolist())
+
+    def carry_forward(self, computed: Iterable[Tuple[Any, ...]]) -> Dict[str, Tuple[Any, ...]]:
+        """
+        Merges the recomputed results with the results of the unchanged nodes of the previous version, and makes
+        the current version the new previous one.
+        :param computed: Results of the recomputed nodes, as tuples whose first element is the key
+        :return: Results of the current version
+        """
+        graph, signatures, diff = self._pending
+        view = GraphView(graph)
+        unchanged = np.isin(view.vertex(self.key), list(diff.unchanged))
+        carried = set(view.vertex(self.result_key)[unchanged].tolist())
+
+        results = {k: v for k, v in self.results.items() if k in carried}
+        for result in computed:
+            results[result[0]] = result
+
+        self.signatures = signatures
+        self.results = results
+        self._pending = None
+        return results
+
+    def values(self) -> List[Tuple[Any, ...]]:
+        return list(self.results.values())
+
+
+def carry_forward_labels(contents: Dict[str, Any], previous: Optional[Tuple[Dict[str, Any], Dict[str, Any]]]):
+    """
+    Splits the nodes of a version in the ones whose content is the same as in the previous version, and the ones
+    that have to be annotated again.
+    :param contents: Content of the nodes in the current version
+    :param previous: Content and labels of the nodes in the previous version
+    :return: The labels carried forward, and the content of the nodes to annotate
+    """
+    if not previous:
+        return {}, contents
+
+    previous_contents, previous_labels = previous
+    carried = {}
+    todo = {}
+    for node, content in contents.items():
+        if node in previous_labels and previous_contents.get(node) == content:
+            carried[node] = previous_labels[node]
+        else:
+            todo[node] = content
+
+    return carried, todo
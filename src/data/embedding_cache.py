@@ -0,0 +1,211 @@
+import hashlib
+import os
+import sqlite3
+import time
+from os.path import join, exists, getsize
+from typing import Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+
+class EmbeddingCache:
+    """
+    Persistent cache of the embeddings computed by a model, keyed by the hash of the embedded text. The vectors are
+    appended as float32 rows to shard files, each process writing to its own shard, and their position is stored in
+    a SQLite index. When the shards grow over the maximum size, the least recently used shards are evicted. Only
+    sealed shards, which are no longer appended to, or the shards of processes that are no longer running are
+    evicted. Each write is committed in its own short transaction, so the processes sharing the cache do not hold its
+    write lock.
+    """
+
+    def __init__(self, path: str, max_size: int = 1024, shard_rows: int = 65536, flush_every: int = 1000):
+        """
+        :param path: Folder of the cache of the model
+        :param max_size: Maximum size of the shards, in MB
+        :param shard_rows: Maximum number of vectors of each shard
+        :param flush_every: Number of accesses after which the access times of the shards are written
+        """
+        self.path = path
+        self.max_size = max_size * 1024 * 1024
+        self.shard_rows = shard_rows
+        self.flush_every = flush_every
+        os.makedirs(path, exist_ok=True)
+        self.conn = sqlite3.connect(join(path, "index.sqlite"), timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, shard INTEGER, row INTEGER)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_shard ON entries (shard)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS shards (id INTEGER PRIMARY KEY, dim INTEGER, "
+                              "rows INTEGER, used REAL, owner INTEGER, sealed INTEGER DEFAULT 1)")
+            columns = {x[1] for x in self.conn.execute("PRAGMA table_info(shards)")}
+            if 'sealed' not in columns:
+                # Shards written before the owners were recorded
+                self.conn.execute("ALTER TABLE shards ADD COLUMN owner INTEGER")
+                self.conn.execute("ALTER TABLE shards ADD COLUMN sealed INTEGER DEFAULT 1")
+        self.hits = 0
+        self.misses = 0
+        self.shard = None
+        self.file = None
+        self._maps = {}
+        self._touched = set()
+        self._accesses = 0
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha1(text.encode("utf8", errors="surrogatepass")).hexdigest()
+
+    def shard_path(self, shard: int) -> str:
+        return join(self.path, f"shard-{shard}.f32")
+
+    def _rows(self, shard: int, dim: int, row: int) -> np.ndarray:
+        rows = self._maps.get(shard)
+        if rows is None or row >= len(rows):
+            # The shard may have grown since it was mapped
+            n = getsize(self.shard_path(shard)) // (dim * 4)
+            rows = np.memmap(self.shard_path(shard), dtype=np.float32, mode='r', shape=(n, dim))
+            self._maps[shard] = rows
+        return rows
+
+    def get(self, texts: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Returns the cached embeddings of the texts.
+        :param texts:
+        :return: Map from text to embedding, for the texts in the cache
+        """
+        keys = {self.key(text): text for text in texts}
+        found = {}
+        items = list(keys)
+        for i in range(0, len(items), 500):
+            chunk = items[i:i + 500]
+            rows = self.conn.execute(f"SELECT e.key, e.shard, e.row, s.dim FROM entries e JOIN shards s "
+                                     f"ON e.shard = s.id WHERE e.key IN ({','.join('?' * len(chunk))})",
+                                     chunk).fetchall()
+            for key, shard, row, dim in rows:
+                try:
+                    found[keys[key]] = np.array(self._rows(shard, dim, row)[row])
+                except (OSError, ValueError, IndexError):
+                    # The shard was evicted by another process
+                    continue
+                self._touched.add(shard)
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        self._accesses += len(found)
+        if self._accesses >= self.flush_every:
+            self.flush()
+        return found
+
+    def put(self, texts: List[str], embeddings: np.ndarray) -> None:
+        """
+        Stores the embeddings of the texts, evicting the least recently used shards if the cache is full.
+        :param texts:
+        :param embeddings: Embeddings of the texts, one per row
+        :return:
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if not len(texts):
+            return
+
+        dim = embeddings.shape[1]
+        if self.shard is None or self.shard[1] != dim or self.shard[2] >= self.shard_rows:
+            self._open_shard(dim)
+
+        shard, _, rows = self.shard
+        self.file.write(embeddings.tobytes())
+        self.file.flush()
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                                  [(self.key(text), shard, rows + i) for i, text in enumerate(texts)])
+            self.conn.execute("UPDATE shards SET rows = ?, used = ? WHERE id = ?",
+                              (rows + len(texts), time.time(), shard))
+        self.shard = (shard, dim, rows + len(texts))
+
+        if self.size() > self.max_size:
+            self.evict()
+
+    def _open_shard(self, dim: int) -> None:
+        self._seal()
+        with self.conn:
+            shard = self.conn.execute("INSERT INTO shards (dim, rows, used, owner, sealed) VALUES (?, 0, ?, ?, 0)",
+                                      (dim, time.time(), os.getpid())).lastrowid
+        self.file = open(self.shard_path(shard), 'wb')
+        self.shard = (shard, dim, 0)
+
+    def _seal(self) -> None:
+        """
+        Closes the shard being written, which can then be evicted by any process.
+        """
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        with self.conn:
+            self.conn.execute("UPDATE shards SET sealed = 1 WHERE id = ?", (self.shard[0],))
+        self.shard = None
+
+    @staticmethod
+    def _running(pid: Optional[int]) -> bool:
+        if pid is None:
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def size(self) -> int:
+        """
+        Returns the size of the shards in bytes.
+        """
+        return self.conn.execute("SELECT COALESCE(SUM(rows * dim * 4), 0) FROM shards").fetchone()[0]
+
+    def flush(self) -> None:
+        """
+        Writes the pending access times of the shards.
+        """
+        if self._touched:
+            now = time.time()
+            with self.conn:
+                self.conn.executemany("UPDATE shards SET used = ? WHERE id = ?", [(now, x) for x in self._touched])
+            self._touched = set()
+        self._accesses = 0
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used shards until the cache is under 90% of its maximum size. The shards still
+        written by a running process, including this one, are kept.
+        """
+        self.flush()
+        target = int(self.max_size * 0.9)
+        total = self.size()
+        evicted = 0
+        for shard, size, owner, sealed in self.conn.execute("SELECT id, rows * dim * 4, owner, sealed FROM shards "
+                                                            "ORDER BY used").fetchall():
+            if total <= target:
+                break
+            if not sealed and self._running(owner):
+                continue
+            total -= size
+            with self.conn:
+                self.conn.execute("DELETE FROM entries WHERE shard = ?", (shard,))
+                self.conn.execute("DELETE FROM shards WHERE id = ?", (shard,))
+            self._maps.pop(shard, None)
+            if exists(self.shard_path(shard)):
+                os.remove(self.shard_path(shard))
+            evicted += 1
+        logger.info(f"Evicted {evicted} shards from the embedding cache {self.path}")
+
+    def close(self) -> None:
+        if self.conn is None:
+            return
+        self.flush()
+        self._seal()
+        self.conn.close()
+        self.conn = None
+
+    def __str__(self):
+        return f"hits: {self.hits}, misses: {self.misses}, size: {self.size() / 1024 / 1024:.1f}MB"
@@ -0,0 +1,85 @@
+import os
+from os.path import exists, getsize
+from typing import List, Tuple
+
+import numpy as np
+
+from data.strings import pack_strings, unpack_strings
+
+
+class EmbeddingWriter:
+    """
+    Writes the embeddings of the nodes of a project version as a binary matrix, one row per node, and the names of the
+    nodes in a separate index file. Rows are streamed to a temporary file, moved to the final path when the writer is
+    closed without errors.
+    """
+
+    def __init__(self, path: str, dtype: str = 'float32'):
+        """
+        :param path: Path of the matrix, the index is saved in `{path}.idx.npz`
+        :param dtype: Type of the values, float32 or float16
+        """
+        self.path = path
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.tmp = f"{path}.tmp-{os.getpid()}"
+        self.file = None
+        self.names = []
+        self.dim = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.file = open(self.tmp, 'wb')
+        return self
+
+    def write(self, name: str, vector: np.ndarray) -> None:
+        """
+        Writes the embedding of a node.
+        :param name: Name of the node
+        :param vector: Embedding of the node
+        :return:
+        """
+        vector = np.asarray(vector, dtype=self.dtype).ravel()
+        if self.dim is None:
+            self.dim = len(vector)
+        elif len(vector) != self.dim:
+            raise ValueError(f"Embedding of {name} has size {len(vector)} instead of {self.dim}")
+        self.file.write(vector.tobytes())
+        self.names.append(name)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.file.close()
+        if exc_type is not None:
+            os.remove(self.tmp)
+            return
+
+        names_data, names_offsets = pack_strings(self.names)
+        index_tmp = f"{self.path}.idx.tmp-{os.getpid()}.npz"
+        np.savez(index_tmp, names_data=names_data, names_offsets=names_offsets, dim=self.dim or 0,
+                 dtype=self.dtype.str)
+        # The index is replaced first, so a reader seeing the new matrix also sees its index. A reader seeing the new
+        # index with the old matrix fails on the size check of load_embeddings, unless they have the same shape
+        os.replace(index_tmp, f"{self.path}.idx.npz")
+        os.replace(self.tmp, self.path)
+
+
+def load_embeddings(path: str) -> Tuple[List[str], np.ndarray]:
+    """
+    Loads the embeddings written by EmbeddingWriter. The matrix is memory mapped read-only.
+    :param path: Path of the matrix
+    :return: The names of the nodes and the matrix of their embeddings, one row per node
+    :raises ValueError: If the size of the matrix does not match its index
+    """
+    with np.load(f"{path}.idx.npz") as index:
+        names = unpack_strings(index['names_data'], index['names_offsets'])
+        dim = int(index['dim'])
+        dtype = np.dtype(str(index['dtype']))
+
+    if getsize(path) != len(names) * dim * dtype.itemsize:
+        raise ValueError(f"Size of {path} does not match its index")
+    if not names:
+        return names, np.zeros((0, dim), dtype=dtype)
+    return names, np.memmap(path, dtype=dtype, mode='r', shape=(len(names), dim))
+
+
+def embeddings_exist(path: str) -> bool:
+    return exists(path) and exists(f"{path}.idx.npz")
@@ -1,6 +1,20 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import xml.etree.ElementTree as ElementTree
+from xml.parsers import expat
 from abc import ABC, abstractmethod
+from numbers import Number
+from os.path import join, basename, dirname, abspath, exists
+from typing import Optional, List, Tuple, Iterable, IO, Union
 
 import igraph
+import numpy as np
+from loguru import logger
+
+from data.strings import pack_strings, unpack_strings
 
 
 class GraphLoader(ABC):
@@ -9,25 +23,588 @@ class GraphLoader(ABC):
         raise NotImplemented
 
 
+class GraphCache:
+    """
+    Binary on-disk cache for igraph graphs. Each graph is converted once into a directory of numpy arrays
+    (the edge list plus one column per vertex/edge attribute) that are memory mapped when loaded back.
+    Entries are keyed by the graph path and the cleaning profile, and are invalidated when the mtime or size
+    of the source file changes.
+    """
+
+    version = 1
+
+    def __init__(self, cache_dir: str = None):
+        """
+        :param cache_dir: Root folder of the cache. If None, the cache is stored in a `.cache` folder next to
+        each graph, which is skipped by the globs used to list the Arcan output.
+        """
+        self.cache_dir = cache_dir
+
+    def entry_path(self, path: str, profile: str) -> str:
+        """
+        Returns the folder holding the cached version of the graph for the given profile.
+        :param path: Path of the source graph
+        :param profile: Name of the cleaning profile applied to the graph
+        :return:
+        """
+        path = abspath(path)
+        name = f"{basename(path)}.{profile}"
+        if self.cache_dir:
+            return join(self.cache_dir, basename(dirname(path)), name)
+
+        return join(dirname(path), '.cache', name)
+
+    @staticmethod
+    def _source_key(path: str, profile: str) -> dict:
+        stat = os.stat(path)
+        return {'path': abspath(path), 'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'profile': profile,
+                'version': GraphCache.version}
+
+    def read_meta(self, path: str, profile: str) -> Optional[dict]:
+        """
+        Returns the metadata of a valid cache entry, or None if the entry is missing or stale.
+        :param path: Path of the source graph
+        :param profile: Name of the cleaning profile
+        :return:
+        """
+        meta_path = join(self.entry_path(path, profile), 'meta.json')
+        if not exists(meta_path):
+            return None
+
+        try:
+            with open(meta_path, 'rt') as inf:
+                meta = json.load(inf)
+        except (OSError, ValueError):
+            return None
+
+        if meta.get('key') != self._source_key(path, profile):
+            return None
+
+        return meta
+
+    def load(self, path: str, profile: str) -> Optional[igraph.Graph]:
+        """
+        Loads the cached graph, returns None on a cache miss.
+        :param path: Path of the source graph
+        :param profile: Name of the cleaning profile
+        :return:
+        """
+        meta = self.read_meta(path, profile)
+        if meta is None:
+            return None
+
+        return self.load_entry(path, profile, meta)
+
+    def load_entry(self, path: str, profile: str, meta: dict) -> Optional[igraph.Graph]:
+        """
+        Loads the graph from an entry already validated with read_meta.
+        :param path: Path of the source graph
+        :param profile: Name of the cleaning profile
+        :param meta: Metadata of the entry
+        :return:
+        """
+        entry = self.entry_path(path, profile)
+        try:
+            edges = np.load(join(entry, 'edges.npy'), mmap_mode='r')
+            graph = igraph.Graph(n=meta['vertices'], edges=edges.tolist(), directed=meta['directed'])
+            for attr, kind in meta['vertex_attributes']:
+                graph.vs[attr] = self._read_column(entry, f'v_{attr}', kind)
+            for attr, kind in meta['edge_attributes']:
+                graph.es[attr] = self._read_column(entry, f'e_{attr}', kind)
+            for attr, value in meta['graph_attributes'].items():
+                graph[attr] = value
+        except (OSError, ValueError) as e:
+            logger.warning(f"Invalid graph cache entry {entry}: {e}")
+            return None
+
+        return graph
+
+    def save(self, path: str, profile: str, graph: igraph.Graph, report: dict = None) -> None:
+        """
+        Stores the graph in the cache. The entry is written in a temporary folder and then moved in place.
+        :param path: Path of the source graph
+        :param profile: Name of the cleaning profile
+        :param graph: Graph to store
+        :param report: Cleaning report of the graph
+        :return:
+        """
+        entry = self.entry_path(path, profile)
+        tmp = f"{entry}.tmp-{os.getpid()}"
+        os.makedirs(tmp, exist_ok=True)
+
+        edges = np.array(graph.get_edgelist(), dtype=np.int32).reshape(-1, 2)
+        np.save(join(tmp, 'edges.npy'), edges)
+
+        vertex_attributes = [(attr, self._write_column(tmp, f'v_{attr}', graph.vs[attr]))
+                             for attr in graph.vs.attributes()]
+        edge_attributes = [(attr, self._write_column(tmp, f'e_{attr}', graph.es[attr]))
+                           for attr in graph.es.attributes()]
+        graph_attributes = {attr: graph[attr] for attr in graph.attributes()
+                            if isinstance(graph[attr], (str, Number, bool))}
+
+        meta = {'key': self._source_key(path, profile), 'directed': graph.is_directed(),
+                'vertices': graph.vcount(), 'edges': graph.ecount(), 'vertex_attributes': vertex_attributes,
+                'edge_attributes': edge_attributes, 'graph_attributes': graph_attributes, 'report': report}
+        with open(join(tmp, 'meta.json'), 'wt') as outf:
+            json.dump(meta, outf)
+
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+
+    @staticmethod
+    def _write_column(folder: str, name: str, values: List) -> str:
+        """
+        Writes an attribute column. Boolean and numeric columns are stored as numpy arrays, every other column
+        as a UTF-8 buffer plus an array of offsets.
+        :return: The kind of the column
+        """
+        if values and all(isinstance(v, bool) for v in values):
+            np.save(join(folder, f'{name}.npy'), np.array(values, dtype=np.bool_))
+            return 'bool'
+
+        if all(v is None or (isinstance(v, Number) and not isinstance(v, bool)) for v in values):
+            column = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+            np.save(join(folder, f'{name}.npy'), column)
+            return 'float'
+
+        data, offsets = pack_strings(values)
+        np.save(join(folder, f'{name}.data.npy'), data)
+        np.save(join(folder, f'{name}.offsets.npy'), offsets)
+        return 'str'
+
+    @staticmethod
+    def _read_column(folder: str, name: str, kind: str) -> List:
+        if kind in ('float', 'bool'):
+            return np.load(join(folder, f'{name}.npy'), mmap_mode='r').tolist()
+
+        data = np.load(join(folder, f'{name}.data.npy'), mmap_mode='r')
+        offsets = np.load(join(folder, f'{name}.offsets.npy'), mmap_mode='r')
+        return unpack_strings(data, offsets)
+
+
+class GraphView:
+    """
+    Read-only vectorized view of an igraph graph. Vertex and edge attributes are exposed as numpy arrays (or as
+    categorical codes), and the adjacency as CSR arrays, so that selections can be written as masks instead of
+    loops over graph.vs and graph.es. E.g., the units with a container as out-neighbour:
+
+        view = GraphView(graph)
+        containers = view.vertex('labelV') == 'container'
+        units = (view.vertex('labelV') == 'unit') & view.any_neighbor(containers, mode='out')
+
+    The arrays are computed lazily and cached, the view must not be used after the graph is modified.
+    """
+
+    def __init__(self, graph: igraph.Graph):
+        self.graph = graph
+        self.n = graph.vcount()
+        self.m = graph.ecount()
+        edges = np.array(graph.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+        self.source = edges[:, 0]
+        self.target = edges[:, 1]
+        self._vertex = {}
+        self._edge = {}
+        self._csr = {}
+
+    def vertex(self, attr: str) -> np.ndarray:
+        """
+        Returns a vertex attribute as an array, numeric attributes as float64 and the others as strings.
+        """
+        if attr not in self._vertex:
+            self._vertex[attr] = _column_array(self.graph.vs[attr] if self.n else [])
+        return self._vertex[attr]
+
+    def edge(self, attr: str) -> np.ndarray:
+        """
+        Returns an edge attribute as an array, numeric attributes as float64 and the others as strings.
+        """
+        if attr not in self._edge:
+            self._edge[attr] = _column_array(self.graph.es[attr] if self.m else [])
+        return self._edge[attr]
+
+    def vertex_codes(self, attr: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the categorical codes of a vertex attribute and the sorted categories.
+        """
+        categories, codes = np.unique(self.vertex(attr), return_inverse=True)
+        return codes.astype(np.int32), categories
+
+    def edge_codes(self, attr: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the categorical codes of an edge attribute and the sorted categories.
+        """
+        categories, codes = np.unique(self.edge(attr), return_inverse=True)
+        return codes.astype(np.int32), categories
+
+    def vertex_mask(self, attr: str, values: Iterable) -> np.ndarray:
+        """
+        Returns the mask of the vertices whose attribute is one of the values.
+        """
+        return np.isin(self.vertex(attr), list(values))
+
+    def edge_mask(self, attr: str, values: Iterable) -> np.ndarray:
+        """
+        Returns the mask of the edges whose attribute is one of the values.
+        """
+        return np.isin(self.edge(attr), list(values))
+
+    def csr(self, mode: str = 'out') -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the adjacency in CSR form. The neighbours of vertex v are indices[indptr[v]:indptr[v + 1]], reached
+        through the edges edge_ids[indptr[v]:indptr[v + 1]].
+        :param mode: 'out', 'in' or 'all'
+        :return: indptr, indices, edge_ids
+        """
+        if mode not in self._csr:
+            edge_ids = np.arange(self.m, dtype=np.int64)
+            if mode == 'out':
+                rows, cols = self.source, self.target
+            elif mode == 'in':
+                rows, cols = self.target, self.source
+            elif mode == 'all':
+                rows = np.concatenate([self.source, self.target])
+                cols = np.concatenate([self.target, self.source])
+                edge_ids = np.concatenate([edge_ids, edge_ids])
+            else:
+                raise ValueError(f"Unknown mode {mode}")
+
+            order = np.lexsort((cols, rows))
+            indptr = np.zeros(self.n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(rows, minlength=self.n), out=indptr[1:])
+            self._csr[mode] = (indptr, cols[order], edge_ids[order])
+        return self._csr[mode]
+
+    def neighbors(self, vertex: int, mode: str = 'out') -> np.ndarray:
+        indptr, indices, _ = self.csr(mode)
+        return indices[indptr[vertex]:indptr[vertex + 1]]
+
+    def degree(self, mode: str = 'out', edge_mask: np.ndarray = None) -> np.ndarray:
+        """
+        Returns the degree of all the vertices, counting only the edges in the mask if given.
+        """
+        source, target = self.source, self.target
+        if edge_mask is not None:
+            source, target = source[edge_mask], target[edge_mask]
+        rows = {'out': source, 'in': target, 'all': np.concatenate([source, target])}[mode]
+        return np.bincount(rows, minlength=self.n)
+
+    def any_neighbor(self, vertex_mask: np.ndarray, mode: str = 'out', edge_mask: np.ndarray = None) -> np.ndarray:
+        """
+        Returns the mask of the vertices with at least one neighbour in vertex_mask.
+        :param vertex_mask: Mask of the target vertices
+        :param mode: 'out', 'in' or 'all'
+        :param edge_mask: If given, only the edges in the mask are followed
+        :return:
+        """
+        edges = np.ones(self.m, dtype=bool) if edge_mask is None else edge_mask
+        res = np.zeros(self.n, dtype=bool)
+        if mode in ('out', 'all'):
+            res[self.source[edges & vertex_mask[self.target]]] = True
+        if mode in ('in', 'all'):
+            res[self.target[edges & vertex_mask[self.source]]] = True
+        return res
+
+
+def _column_array(values: List) -> np.ndarray:
+    if values and all(v is None or (isinstance(v, Number) and not isinstance(v, bool)) for v in values):
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    return np.array(["" if v is None else v for v in values], dtype=str)
+
+
+class CleaningProfile:
+    """
+    Set of rules used to clean a graph. All the rules are evaluated as masks over the vertex and edge attributes
+    and applied together, see clean_graph.
+    """
+
+    def __init__(self, name: str, drop_edge_labels: Iterable[str] = None, keep_edge_labels: Iterable[str] = None,
+                 keep_vertex_labels: Iterable[str] = None, drop_nested: bool = False, drop_isolated: bool = False,
+                 weight: str = None):
+        """
+        :param name: Name of the profile, used to key the graph cache.
+        :param drop_edge_labels: Edges with one of these labels are removed.
+        :param keep_edge_labels: If set, only the edges with one of these labels are kept.
+        :param keep_vertex_labels: If set, only the vertices with one of these labels are kept.
+        :param drop_nested: Whether to remove the inner classes (names containing `$`) that are not containers.
+        :param drop_isolated: Whether to remove the vertices left without edges.
+        :param weight: Edge attribute copied in the `weight` attribute.
+        """
+        self.name = name
+        self.drop_edge_labels = list(drop_edge_labels) if drop_edge_labels else []
+        self.keep_edge_labels = list(keep_edge_labels) if keep_edge_labels is not None else None
+        self.keep_vertex_labels = list(keep_vertex_labels) if keep_vertex_labels is not None else None
+        self.drop_nested = drop_nested
+        self.drop_isolated = drop_isolated
+        self.weight = weight
+
+
+CLEANING_PROFILES = {
+    'clean': CleaningProfile('clean',
+                             drop_edge_labels=["isChildOf", "isImplementationOf", "nestedTo",
+                                               "belongsTo", "implementedBy", "definedBy",
+                                               "containerIsAfferentOf", "unitIsAfferentOf"],
+                             drop_nested=True, drop_isolated=True, weight='Weight'),
+    'belongs_to': CleaningProfile('belongs_to', keep_edge_labels=['belongsTo'],
+                                  keep_vertex_labels=['container', 'unit']),
+}
+
+
+def clean_graph(graph: igraph.Graph, profile: CleaningProfile) -> Tuple[igraph.Graph, dict]:
+    """
+    Cleans the graph in a single pass. The vertex and edge keep-masks are computed from the attribute arrays and
+    then applied with one deletion.
+    :param graph: Graph to clean
+    :param profile: Cleaning rules
+    :return: The cleaned graph and a report with the number of vertices and edges removed by each rule
+    """
+    view = GraphView(graph)
+    n, m = view.n, view.m
+    report = {'profile': profile.name, 'vertices': n, 'edges': m}
+
+    if profile.weight and m:
+        graph.es['weight'] = graph.es[profile.weight]
+
+    keep_vertices = np.ones(n, dtype=bool)
+    if profile.keep_vertex_labels is not None:
+        keep = view.vertex_mask('labelV', profile.keep_vertex_labels)
+        report['removed_vertices_label'] = int(np.count_nonzero(keep_vertices & ~keep))
+        keep_vertices &= keep
+    if profile.drop_nested:
+        nested = (np.char.find(view.vertex('name'), '$') >= 0) & (view.vertex('labelV') != 'container')
+        report['removed_vertices_nested'] = int(np.count_nonzero(keep_vertices & nested))
+        keep_vertices &= ~nested
+
+    keep_edges = keep_vertices[view.source] & keep_vertices[view.target]
+    report['removed_edges_vertices'] = int(m - np.count_nonzero(keep_edges))
+
+    if profile.drop_edge_labels or profile.keep_edge_labels is not None:
+        drop = np.zeros(m, dtype=bool)
+        if profile.drop_edge_labels:
+            drop |= view.edge_mask('labelE', profile.drop_edge_labels)
+        if profile.keep_edge_labels is not None:
+            drop |= ~view.edge_mask('labelE', profile.keep_edge_labels)
+        drop &= keep_edges
+        labels, counts = np.unique(view.edge('labelE')[drop], return_counts=True)
+        report['removed_edges_label'] = {str(label): int(count) for label, count in zip(labels, counts)}
+        keep_edges &= ~drop
+
+    if profile.drop_isolated:
+        degree = view.degree('all', keep_edges)
+        isolated = keep_vertices & (degree == 0)
+        report['removed_vertices_isolated'] = int(np.count_nonzero(isolated))
+        # Every kept vertex has a kept edge, so the subgraph spanned by the kept edges is the cleaned graph
+        graph = graph.subgraph_edges(np.flatnonzero(keep_edges).tolist(), delete_vertices=True)
+    else:
+        graph.delete_edges(np.flatnonzero(~keep_edges).tolist())
+        graph.delete_vertices(np.flatnonzero(~keep_vertices).tolist())
+
+    report['removed_vertices'] = n - graph.vcount()
+    report['removed_edges'] = m - graph.ecount()
+
+    return graph, report
+
+
 class ArcanGraphLoader(GraphLoader):
-    def __init__(self, clean: bool = False):
-        self.clean_edges = ["isChildOf", "isImplementationOf", "nestedTo",
-                            "belongsTo", "implementedBy", "definedBy",
-                            "containerIsAfferentOf", "unitIsAfferentOf"]
+    def __init__(self, clean: Union[bool, str] = False, cache: bool = True, cache_dir: str = None):
+        """
+        :param clean: Whether to clean the graph. Either a boolean, or the name of a profile in CLEANING_PROFILES.
+        :param cache: Whether to use the binary graph cache.
+        :param cache_dir: Root folder of the cache, see GraphCache.
+        """
         self.clean = clean
+        self.cleaning = None
+        if clean:
+            self.cleaning = CLEANING_PROFILES[clean if isinstance(clean, str) else 'clean']
+        self.cache = GraphCache(cache_dir) if cache else None
+        self.report = None
+
+    @property
+    def profile(self) -> str:
+        """
+        Name of the cleaning profile, used to key the cache.
+        """
+        return self.cleaning.name if self.cleaning else 'raw'
 
     def load(self, path: str) -> igraph.Graph:
-        graph = igraph.Graph.Read_GraphML(path)
-        graph = self._clean_graph(graph) if self.clean else graph
+        self.report = None
+        if self.cache:
+            meta = self.cache.read_meta(path, self.profile)
+            graph = self.cache.load_entry(path, self.profile, meta) if meta else None
+            if graph is not None:
+                self.report = meta.get('report')
+                return graph
+
+        graph = self.read(path)
+        graph = self._clean_graph(graph) if self.cleaning else graph
+
+        if self.cache:
+            try:
+                self.cache.save(path, self.profile, graph, self.report)
+            except OSError as e:
+                logger.warning(f"Could not cache graph {path}: {e}")
+
         return graph
 
-    def _clean_graph(self, graph: igraph.Graph) -> igraph.Graph:
-        graph.es['weight'] = graph.es['Weight']
-        delete = [x.index for x in graph.vs if "$" in x['name'] and x['labelV'] != 'container']
-        graph.delete_vertices(delete)
-        for edge_label in self.clean_edges:
-            graph.es.select(labelE=edge_label).delete()
+    def read(self, path: str) -> igraph.Graph:
+        """
+        Parses the graph from the source file.
+        :param path:
+        :return:
+        """
+        return igraph.Graph.Read_GraphML(path)
 
-        graph.vs.select(_degree=0).delete()
+    def _clean_graph(self, graph: igraph.Graph) -> igraph.Graph:
+        graph, self.report = clean_graph(graph, self.cleaning)
+        logger.debug(f"Cleaned graph: {self.report}")
 
         return graph
+
+    def warm(self, path: str) -> bool:
+        """
+        Makes sure the graph is in the cache.
+        :param path:
+        :return: True if the graph had to be converted
+        """
+        if self.cache is None or self.cache.read_meta(path, self.profile) is not None:
+            return False
+
+        self.load(path)
+        return True
+
+
+class StreamingGraphMLLoader(ArcanGraphLoader):
+    """
+    GraphML loader based on incremental XML parsing. Only the attributes in the projection are kept, every other
+    data element is skipped while parsing. Gzip-compressed files are detected and decompressed on the fly.
+    """
+
+    attributes = ('name', 'filePathRelative', 'labelV', 'labelE', 'Weight')
+
+    def __init__(self, clean: Union[bool, str] = False, cache: bool = True, cache_dir: str = None,
+                 attributes: Iterable[str] = None):
+        """
+        :param clean: Whether to clean the graph, see ArcanGraphLoader.
+        :param cache: Whether to use the binary graph cache.
+        :param cache_dir: Root folder of the cache, see GraphCache.
+        :param attributes: Names of the vertex and edge attributes to load. The node ids are kept as the `id`
+        vertex attribute only if `id` is part of the projection.
+        """
+        super().__init__(clean, cache, cache_dir)
+        self.attributes = tuple(attributes) if attributes is not None else self.attributes
+
+    @property
+    def profile(self) -> str:
+        projection = hashlib.md5(",".join(sorted(self.attributes)).encode("utf8")).hexdigest()[:8]
+        return f"{super().profile}-{projection}"
+
+    @staticmethod
+    def _open(path: str) -> IO[bytes]:
+        with open(path, 'rb') as inf:
+            magic = inf.read(2)
+        return gzip.open(path, 'rb') if magic == b'\x1f\x8b' else open(path, 'rb')
+
+    @staticmethod
+    def _convert(value: Optional[str], kind: str):
+        if kind in ('int', 'long', 'float', 'double'):
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return float('nan')
+        if kind == 'boolean':
+            return value is not None and value.strip().lower() in ('true', '1')
+        return "" if value is None else value
+
+    def read(self, path: str) -> igraph.Graph:
+        projection = set(self.attributes)
+        keys = {}
+        defaults = {'node': {}, 'edge': {}}
+        vertex_index = {}
+        vertex_attrs = {}
+        edges = []
+        edge_attrs = {}
+        directed = True
+        graph_elem = None
+
+        with self._open(path) as inf:
+            for event, elem in ElementTree.iterparse(inf, events=('start', 'end')):
+                tag = elem.tag.rsplit('}', 1)[-1]
+                if event == 'start':
+                    if tag == 'graph' and graph_elem is None:
+                        graph_elem = elem
+                        directed = elem.get('edgedefault', 'directed') == 'directed'
+                    continue
+
+                if tag == 'key':
+                    key = (elem.get('attr.name'), elem.get('attr.type', 'string'), elem.get('for', 'all'))
+                    keys[elem.get('id')] = key
+                    name, kind, domain = key
+                    default = next((x.text for x in elem if x.tag.rsplit('}', 1)[-1] == 'default'), None)
+                    for target in ('node', 'edge'):
+                        if name in projection and domain in (target, 'all'):
+                            defaults[target][name] = self._convert(default, kind)
+                elif tag == 'node':
+                    index = self._vertex(elem.get('id'), vertex_index, vertex_attrs, defaults['node'])
+                    for name, value in self._data(elem, keys, projection):
+                        vertex_attrs[name][index] = value
+                elif tag == 'edge':
+                    source = self._vertex(elem.get('source'), vertex_index, vertex_attrs, defaults['node'])
+                    target = self._vertex(elem.get('target'), vertex_index, vertex_attrs, defaults['node'])
+                    for name, default in defaults['edge'].items():
+                        if name not in edge_attrs:
+                            edge_attrs[name] = [default] * len(edges)
+                        edge_attrs[name].append(default)
+                    for name, value in self._data(elem, keys, projection):
+                        edge_attrs[name][-1] = value
+                    edges.append((source, target))
+
+                if tag in ('node', 'edge') and graph_elem is not None:
+                    graph_elem.clear()
+
+        if 'id' in projection:
+            vertex_attrs['id'] = list(vertex_index)
+
+        return igraph.Graph(n=len(vertex_index), edges=edges, directed=directed,
+                            vertex_attrs=vertex_attrs, edge_attrs=edge_attrs)
+
+    @staticmethod
+    def _vertex(node_id: str, vertex_index: dict, vertex_attrs: dict, defaults: dict) -> int:
+        if node_id not in vertex_index:
+            vertex_index[node_id] = len(vertex_index)
+            for name, default in defaults.items():
+                vertex_attrs.setdefault(name, []).append(default)
+        return vertex_index[node_id]
+
+    def _data(self, elem, keys: dict, projection: set):
+        for child in elem:
+            if child.tag.rsplit('}', 1)[-1] != 'data':
+                continue
+            name, kind, _ = keys.get(child.get('key'), (None, None, None))
+            if name in projection:
+                yield name, self._convert(child.text, kind)
+
+
+def graph_stats(path: str, cache_dir: str = None) -> Tuple[int, int]:
+    """
+    Returns the number of vertices and edges of a raw graph without building it. The counts are read from the
+    graph cache when available, otherwise the GraphML elements are counted while streaming the file.
+    :param path: Path of the GraphML file
+    :param cache_dir: Root folder of the graph cache
+    :return:
+    """
+    meta = GraphCache(cache_dir).read_meta(path, ArcanGraphLoader().profile)
+    if meta is not None:
+        return meta['vertices'], meta['edges']
+
+    counts = {'node': 0, 'edge': 0}
+
+    def start_element(name, _):
+        tag = name.rsplit('}', 1)[-1]
+        if tag in counts:
+            counts[tag] += 1
+
+    parser = expat.ParserCreate(namespace_separator='}')
+    parser.StartElementHandler = start_element
+    with StreamingGraphMLLoader._open(path) as inf:
+        parser.ParseFile(inf)
+
+    return counts['node'], counts['edge']
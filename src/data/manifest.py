@@ -0,0 +1,149 @@
+import hashlib
+import os
+import sqlite3
+from os.path import join, abspath, dirname
+from typing import List, Tuple, Optional
+
+from loguru import logger
+
+
+class VersionManifest:
+    """
+    SQLite manifest of the Arcan output folder, mapping each project to its sorted (num, sha, graph path) versions.
+    A project is listed again only when the mtime of its folder changes, i.e. when Arcan adds or removes a graph.
+    The manifests are stored outside of the Arcan output folder, one per folder, in the directory set with configure,
+    by default `data/interim/manifests` in the root of the repository.
+    """
+
+    _instances = {}
+    directory = abspath(join(dirname(__file__), '..', '..', 'data', 'interim', 'manifests'))
+
+    def __init__(self, arcan_out: str, path: str = None):
+        """
+        :param arcan_out: Arcan output folder, containing one folder per project
+        :param path: Path of the SQLite file, by default the manifest of the folder in the manifests directory
+        """
+        self.arcan_out = arcan_out
+        self.path = path if path else self.default_path(arcan_out)
+        os.makedirs(dirname(abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS projects (project TEXT PRIMARY KEY, mtime INTEGER)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS versions (project TEXT, num INTEGER, sha TEXT, path TEXT, "
+                              "PRIMARY KEY (project, num, sha))")
+
+    @classmethod
+    def configure(cls, directory: Optional[str]) -> None:
+        """
+        Sets the directory of the manifests of the process, if None the default one is kept.
+        :param directory:
+        :return:
+        """
+        if directory:
+            cls.directory = directory
+
+    @classmethod
+    def default_path(cls, arcan_out: str) -> str:
+        """
+        Returns the path of the manifest of the Arcan output folder in the manifests directory.
+        :param arcan_out: Arcan output folder
+        :return:
+        """
+        folder = hashlib.md5(abspath(arcan_out).encode("utf8")).hexdigest()[:12]
+        return join(cls.directory, f"manifest-{folder}.sqlite")
+
+    @classmethod
+    def get(cls, arcan_out: str) -> 'VersionManifest':
+        """
+        Returns the manifest of the folder, reusing the connection of the current process.
+        :param arcan_out: Arcan output folder
+        :return:
+        """
+        key = (os.getpid(), cls.directory, arcan_out)
+        if key not in cls._instances:
+            cls._instances[key] = cls(arcan_out)
+        return cls._instances[key]
+
+    @staticmethod
+    def scan_project(project_path: str) -> List[Tuple[int, str, str]]:
+        """
+        Lists the graphs of a project.
+        :param project_path: Folder of the project in the Arcan output
+        :return: List of (num, sha, path) sorted by num
+        """
+        res = []
+        with os.scandir(project_path) as it:
+            for entry in it:
+                if not entry.name.endswith('.graphml'):
+                    continue
+                num, sha = entry.name.replace('.graphml', '').split("-")[-1].split("_")
+                res.append((int(num), sha, entry.path))
+        res.sort(key=lambda x: x[0])
+        return res
+
+    def refresh_project(self, project: str) -> bool:
+        """
+        Lists again the graphs of the project if its folder changed since the last refresh.
+        :param project: Project name
+        :return: True if the project was listed again
+        """
+        project_path = join(self.arcan_out, project)
+        try:
+            mtime = os.stat(project_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        row = self.conn.execute("SELECT mtime FROM projects WHERE project = ?", (project,)).fetchone()
+        if row is not None and row[0] == mtime:
+            return False
+
+        versions = self.scan_project(project_path) if mtime is not None else []
+        with self.conn:
+            self.conn.execute("DELETE FROM versions WHERE project = ?", (project,))
+            self.conn.executemany("INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?)",
+                                  [(project, num, sha, path) for num, sha, path in versions])
+            self.conn.execute("INSERT OR REPLACE INTO projects VALUES (?, ?)", (project, mtime))
+
+        return True
+
+    def refresh(self) -> int:
+        """
+        Refreshes all the projects in the Arcan output folder.
+        :return: Number of projects listed again
+        """
+        with os.scandir(self.arcan_out) as it:
+            projects = [entry.name for entry in it if entry.is_dir() and not entry.name.startswith('.')]
+
+        refreshed = sum(self.refresh_project(project) for project in projects)
+        known = [x[0] for x in self.conn.execute("SELECT project FROM projects").fetchall()]
+        for project in set(known) - set(projects):
+            refreshed += self.refresh_project(project)
+
+        logger.info(f"Refreshed {refreshed} projects in the version manifest")
+        return refreshed
+
+    def versions(self, project: str, refresh: bool = True) -> List[Tuple[str, str]]:
+        """
+        Returns the (num, sha) versions of the project, sorted by num.
+        :param project: Project name
+        :param refresh: Whether to check the project folder for new graphs first
+        :return:
+        """
+        if refresh:
+            self.refresh_project(project)
+        rows = self.conn.execute("SELECT num, sha FROM versions WHERE project = ? ORDER BY num",
+                                 (project,)).fetchall()
+        return [(str(num), sha) for num, sha in rows]
+
+    def graphs(self, project: Optional[str] = None) -> List[Tuple[str, str, str, str]]:
+        """
+        Returns the (project, num, sha, path) graphs, of a single project or of all of them.
+        :param project: Project name, None for all the projects
+        :return:
+        """
+        if project is None:
+            rows = self.conn.execute("SELECT project, num, sha, path FROM versions ORDER BY project, num")
+        else:
+            rows = self.conn.execute("SELECT project, num, sha, path FROM versions WHERE project = ? ORDER BY num",
+                                     (project,))
+        return [(name, str(num), sha, path) for name, num, sha, path in rows.fetchall()]
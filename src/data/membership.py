@@ -0,0 +1,185 @@
+import json
+import os
+from collections import defaultdict
+from typing import Dict, List, Iterable, Optional
+
+import igraph
+import numpy as np
+from loguru import logger
+
+from data.graph import ArcanGraphLoader, GraphCache, GraphView
+from data.strings import pack_strings, unpack_strings
+
+
+class MembershipIndex:
+    """
+    File/package membership of a graph version, stored as integer arrays over the vertex order of the raw graph.
+    Two relations are kept:
+    - adjacency: for each vertex, the containers it shares an edge with (in any direction, with multiplicity), and
+      the inverse relation from each container to its adjacent vertices. Both are stored in CSR form.
+    - parent: for each vertex, the target of its `belongsTo` edge, or -1.
+    """
+
+    def __init__(self, names: List[str], paths: List[str], is_container: np.ndarray,
+                 adjacent_indptr: np.ndarray, adjacent_indices: np.ndarray,
+                 members_indptr: np.ndarray, members_indices: np.ndarray, parent: np.ndarray):
+        self.names = names
+        self.paths = paths
+        self.is_container = is_container
+        self.adjacent_indptr = adjacent_indptr
+        self.adjacent_indices = adjacent_indices
+        self.members_indptr = members_indptr
+        self.members_indices = members_indices
+        self.parent = parent
+        self._positions = None
+
+    @classmethod
+    def from_graph(cls, graph: igraph.Graph) -> 'MembershipIndex':
+        """
+        Builds the index from a raw Arcan graph.
+        :param graph:
+        :return:
+        """
+        view = GraphView(graph)
+        n = view.n
+        names = graph.vs['name'] if n else []
+        paths = graph.vs['filePathRelative'] if n else []
+        is_container = view.vertex('labelV') == 'container'
+
+        indptr, indices, _ = view.csr('all')
+        rows = np.repeat(np.arange(n, dtype=np.int64), np.diff(indptr))
+        mask = is_container[indices]
+        rows, indices = rows[mask], indices[mask]
+
+        adjacent_indptr = _indptr(rows, n)
+        adjacent_indices = indices.astype(np.int32)
+
+        order = np.lexsort((rows, indices))
+        members_indptr = _indptr(indices, n)
+        members_indices = rows[order].astype(np.int32)
+
+        parent = np.full(n, -1, dtype=np.int32)
+        belongs = view.edge('labelE') == 'belongsTo'
+        parent[view.source[belongs]] = view.target[belongs]
+
+        return cls(names, paths, is_container, adjacent_indptr, adjacent_indices,
+                   members_indptr, members_indices, parent)
+
+    @staticmethod
+    def index_path(graph_path: str, cache_dir: str = None) -> str:
+        """
+        Returns the path of the persisted index of a graph version, stored alongside the graph cache.
+        :param graph_path: Path of the GraphML file
+        :param cache_dir: Root folder of the graph cache
+        :return:
+        """
+        return GraphCache(cache_dir).entry_path(graph_path, 'membership') + '.npz'
+
+    def save(self, path: str, key: dict = None) -> None:
+        """
+        Saves the index as an uncompressed npz archive.
+        :param path: Output path
+        :param key: Key of the source graph, used to invalidate the index when the graph changes
+        :return:
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        names_data, names_offsets = pack_strings(self.names)
+        paths_data, paths_offsets = pack_strings(self.paths)
+        tmp = f"{path}.tmp-{os.getpid()}.npz"
+        np.savez(tmp, names_data=names_data, names_offsets=names_offsets, paths_data=paths_data,
+                 paths_offsets=paths_offsets, is_container=self.is_container,
+                 adjacent_indptr=self.adjacent_indptr, adjacent_indices=self.adjacent_indices,
+                 members_indptr=self.members_indptr, members_indices=self.members_indices,
+                 parent=self.parent, key=np.array(json.dumps(key)))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, key: dict = None) -> Optional['MembershipIndex']:
+        """
+        Loads a persisted index.
+        :param path: Path of the index
+        :param key: If given, the index is returned only if it was built from a graph with the same key
+        :return: The index, or None if it is missing or stale
+        """
+        if not os.path.exists(path):
+            return None
+
+        with np.load(path) as data:
+            if key is not None and json.loads(str(data['key'])) != key:
+                return None
+            return cls(unpack_strings(data['names_data'], data['names_offsets']),
+                       unpack_strings(data['paths_data'], data['paths_offsets']),
+                       data['is_container'], data['adjacent_indptr'], data['adjacent_indices'],
+                       data['members_indptr'], data['members_indices'], data['parent'])
+
+    @classmethod
+    def load_or_build(cls, graph_path: str, cache_dir: str = None) -> 'MembershipIndex':
+        """
+        Loads the index of a graph version, building and persisting it if missing or stale.
+        :param graph_path: Path of the GraphML file
+        :param cache_dir: Root folder of the graph cache
+        :return:
+        """
+        path = cls.index_path(graph_path, cache_dir)
+        key = GraphCache._source_key(graph_path, 'membership')
+        index = cls.load(path, key)
+        if index is not None:
+            return index
+
+        graph = ArcanGraphLoader(cache_dir=cache_dir).load(graph_path)
+        index = cls.from_graph(graph)
+        try:
+            index.save(path, key)
+        except OSError as e:
+            logger.warning(f"Could not save membership index {path}: {e}")
+
+        return index
+
+    def position(self, name: str) -> int:
+        """
+        Returns the position of the vertex with the given name, or -1.
+        """
+        if self._positions is None:
+            self._positions = {x: i for i, x in enumerate(self.names)}
+        return self._positions.get(name, -1)
+
+    def containers(self, vertex: int) -> np.ndarray:
+        """
+        Returns the containers adjacent to the vertex.
+        """
+        return self.adjacent_indices[self.adjacent_indptr[vertex]:self.adjacent_indptr[vertex + 1]]
+
+    def members(self, container: int) -> np.ndarray:
+        """
+        Returns the vertices adjacent to the container.
+        """
+        return self.members_indices[self.members_indptr[container]:self.members_indptr[container + 1]]
+
+    def num_files(self) -> np.ndarray:
+        """
+        Returns, for each vertex, the number of non-container vertices that belong to it.
+        """
+        files = (self.parent >= 0) & ~self.is_container
+        return np.bincount(self.parent[files], minlength=len(self.parent))
+
+    def package_files(self, files: Iterable[str]) -> Dict[str, List[str]]:
+        """
+        Maps each container to the given files that are adjacent to it.
+        :param files: Relative paths of the files to map
+        :return:
+        """
+        files = set(files)
+        package_files = defaultdict(list)
+        for vertex, path in enumerate(self.paths):
+            if path not in files or path == '.':
+                continue
+            for container in self.containers(vertex).tolist():
+                package_files[self.names[container]].append(path)
+
+        return package_files
+
+
+def _indptr(rows: np.ndarray, n: int) -> np.ndarray:
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr
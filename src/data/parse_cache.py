@@ -0,0 +1,140 @@
+import json
+import os
+import sqlite3
+import time
+import zlib
+from typing import Any, Optional
+
+from loguru import logger
+
+
+class ParseCache:
+    """
+    Persistent content-addressed cache of the content extracted from source files. Entries are keyed by a namespace,
+    identifying the extractor and its configuration, and by the git blob hash of the file, so a file is parsed once
+    for all the versions, forks and vendored copies in which it appears. The values are stored as compressed json.
+    When the cache grows over its maximum size, the least recently used entries are evicted. Each write is committed
+    in its own short transaction, so the processes sharing the cache do not hold its write lock between parses.
+    """
+
+    def __init__(self, path: str, max_size: int = 2048, flush_every: int = 1000):
+        """
+        :param path: Path of the SQLite file
+        :param max_size: Maximum size of the stored values, in MB
+        :param flush_every: Number of accesses after which their times are written
+        """
+        self.path = path
+        self.max_size = max_size * 1024 * 1024
+        self.flush_every = flush_every
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS entries (namespace TEXT, blob TEXT, value BLOB, "
+                              "size INTEGER, used REAL, PRIMARY KEY (namespace, blob))")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+            # Running total of the size of the values, updated in the same transactions as the entries
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (id INTEGER PRIMARY KEY, size INTEGER)")
+            if self.conn.execute("SELECT 1 FROM meta WHERE id = 0").fetchone() is None:
+                self.conn.execute("INSERT OR IGNORE INTO meta SELECT 0, COALESCE(SUM(size), 0) FROM entries")
+        self.size = self._stored_size()
+        self.hits = 0
+        self.misses = 0
+        self._touched = []
+
+    def _stored_size(self) -> int:
+        return self.conn.execute("SELECT size FROM meta WHERE id = 0").fetchone()[0]
+
+    def get(self, namespace: str, blob: str) -> Optional[Any]:
+        """
+        Returns the cached value, or None if missing.
+        :param namespace: Extractor namespace
+        :param blob: Blob hash of the file
+        :return:
+        """
+        row = self.conn.execute("SELECT value FROM entries WHERE namespace = ? AND blob = ?",
+                                (namespace, blob)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._touched.append((time.time(), namespace, blob))
+        if len(self._touched) >= self.flush_every:
+            self.flush()
+        return json.loads(zlib.decompress(row[0]))
+
+    def contains(self, namespace: str, blob: str) -> bool:
+        """
+        Returns whether the value is cached, without counting it as an access.
+        :param namespace: Extractor namespace
+        :param blob: Blob hash of the file
+        :return:
+        """
+        return self.conn.execute("SELECT 1 FROM entries WHERE namespace = ? AND blob = ?",
+                                 (namespace, blob)).fetchone() is not None
+
+    def put(self, namespace: str, blob: str, value: Any) -> None:
+        """
+        Stores a value, evicting the least recently used entries if the cache is full.
+        :param namespace: Extractor namespace
+        :param blob: Blob hash of the file
+        :param value: Json serializable value
+        :return:
+        """
+        data = zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf8"))
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            old = self.conn.execute("SELECT size FROM entries WHERE namespace = ? AND blob = ?",
+                                    (namespace, blob)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                              (namespace, blob, data, len(data), time.time()))
+            self.conn.execute("UPDATE meta SET size = size + ? WHERE id = 0", (len(data) - (old[0] if old else 0),))
+            self.size = self._stored_size()
+        if self.size > self.max_size:
+            self.evict()
+
+    def flush(self) -> None:
+        """
+        Writes the pending access times.
+        """
+        if self._touched:
+            with self.conn:
+                self.conn.executemany("UPDATE entries SET used = ? WHERE namespace = ? AND blob = ?", self._touched)
+            self._touched = []
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used entries until the cache is under 90% of its maximum size.
+        """
+        self.flush()
+        target = int(self.max_size * 0.9)
+        evicted = 0
+        self.size = self._stored_size()
+        while self.size > target:
+            with self.conn:
+                # The entries are selected and removed in the same transaction, so the running total stays exact
+                self.conn.execute("BEGIN IMMEDIATE")
+                size = self._stored_size()
+                remove = []
+                for rowid, entry_size in self.conn.execute("SELECT rowid, size FROM entries ORDER BY used "
+                                                           "LIMIT 1000").fetchall():
+                    if size <= target:
+                        break
+                    remove.append((rowid,))
+                    size -= entry_size
+                self.conn.executemany("DELETE FROM entries WHERE rowid = ?", remove)
+                self.conn.execute("UPDATE meta SET size = ? WHERE id = 0", (size,))
+            self.size = size
+            evicted += len(remove)
+            if not remove:
+                break
+        logger.info(f"Evicted {evicted} entries from the parse cache {self.path}")
+
+    def close(self) -> None:
+        self.flush()
+        self.conn.close()
+
+    def __str__(self):
+        return f"hits: {self.hits}, misses: {self.misses}, size: {self.size / 1024 / 1024:.1f}MB"
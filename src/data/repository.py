@@ -0,0 +1,277 @@
+import hashlib
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from os.path import join, isfile
+from typing import Dict, Optional, Iterable
+
+from utils import git_blob_hashes
+
+
+class GitBlobReader:
+    """
+    Reads objects from the object database of a repository through a long-lived `git cat-file --batch` process,
+    without checking out any version.
+    """
+
+    def __init__(self, repo_path: str):
+        self.repo_path = repo_path
+        self.process = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        self.process = subprocess.Popen(["git", "cat-file", "--batch"], cwd=self.repo_path,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def read(self, obj: str) -> Optional[bytes]:
+        """
+        Returns the content of an object.
+        :param obj: Object name, e.g. a blob hash or `sha:path`
+        :return: The content, or None if the object does not exist
+        """
+        with self.lock:
+            if self.process is None or self.process.poll() is not None:
+                self._start()
+            self.process.stdin.write(obj.encode("utf8") + b"\n")
+            self.process.stdin.flush()
+            header = self.process.stdout.readline().split()
+            if len(header) != 3:
+                return None
+            size = int(header[2])
+            data = self.process.stdout.read(size)
+            self.process.stdout.read(1)
+            return data
+
+    def close(self):
+        with self.lock:
+            if self.process is not None:
+                self.process.stdin.close()
+                self.process.wait()
+                self.process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Snapshot:
+    """
+    Files of a repository at a given version.
+    """
+
+    def read(self, path: str) -> Optional[bytes]:
+        """
+        Returns the content of the file, or None if it does not exist.
+        :param path: Path relative to the repository root
+        :return:
+        """
+        raise NotImplementedError()
+
+    def blob_id(self, path: str) -> Optional[str]:
+        """
+        Returns the blob hash of the file if known without reading it.
+        :param path: Path relative to the repository root
+        :return:
+        """
+        return None
+
+    def close(self):
+        pass
+
+
+class WorkingTreeSnapshot(Snapshot):
+    """
+    Files in the working tree of the repository, i.e. the version that is checked out.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def read(self, path: str) -> Optional[bytes]:
+        path = join(self.root, path)
+        if not isfile(path):
+            return None
+        try:
+            with open(path, "rb") as inf:
+                return inf.read()
+        except OSError:
+            return None
+
+
+class GitSnapshot(Snapshot):
+    """
+    Files of a version read from the object database of the repository.
+    """
+
+    def __init__(self, reader: GitBlobReader, hashes: Dict[str, str]):
+        self.reader = reader
+        self.hashes = hashes
+
+    def read(self, path: str) -> Optional[bytes]:
+        blob = self.hashes.get(path)
+        return self.reader.read(blob) if blob else None
+
+    def blob_id(self, path: str) -> Optional[str]:
+        return self.hashes.get(path)
+
+
+class PrefetchingSnapshot(Snapshot):
+    """
+    Reads the files of a snapshot ahead of their use on a thread pool, so that reading the next files overlaps with
+    parsing the current one. The files are expected to be read in the order of paths, at most depth of them are read
+    ahead. Files that are not prefetched are read directly, prefetched files that are passed over are dropped.
+    """
+
+    def __init__(self, snapshot: Snapshot, paths: Iterable[str], executor: ThreadPoolExecutor, depth: int = 32):
+        """
+        :param snapshot: Snapshot the files are read from
+        :param paths: Paths of the files in the order they are read, consumed lazily
+        :param executor: Thread pool reading the files
+        :param depth: Maximum number of files read ahead
+        """
+        self.snapshot = snapshot
+        self.paths = iter(paths)
+        self.executor = executor
+        self.depth = depth
+        self.pending = OrderedDict()
+        self._fill()
+
+    def _fill(self):
+        while len(self.pending) < self.depth:
+            path = next(self.paths, None)
+            if path is None:
+                break
+            if path not in self.pending:
+                self.pending[path] = self.executor.submit(self.snapshot.read, path)
+
+    def read(self, path: str) -> Optional[bytes]:
+        if path not in self.pending:
+            return self.snapshot.read(path)
+
+        while True:
+            head, future = self.pending.popitem(last=False)
+            if head == path:
+                break
+            future.cancel()
+        self._fill()
+        return future.result()
+
+    def blob_id(self, path: str) -> Optional[str]:
+        return self.snapshot.blob_id(path)
+
+    def close(self):
+        # Reads already running are waited for, so that the readers of the snapshot are not closed under them
+        for future in self.pending.values():
+            future.cancel()
+        wait(self.pending.values())
+        self.pending.clear()
+        self.snapshot.close()
+
+
+class RepositorySource:
+    """
+    Gives access to the files of the versions of the projects in the repositories folder. If from_git is set, the
+    files are read from the git objects, so versions do not need to be checked out and can be read concurrently.
+    Otherwise they are read from the working tree.
+    """
+
+    def __init__(self, repositories: str, from_git: bool = False):
+        """
+        :param repositories: Folder containing one repository per project
+        :param from_git: Whether to read the files from the git objects
+        """
+        self.repositories = repositories
+        self.from_git = from_git
+        self.readers = {}
+        self._hashes = {}
+        self.executor = None
+
+    def repository(self, project: str) -> str:
+        return join(self.repositories, project)
+
+    def hashes(self, project: str, sha: str) -> Optional[Dict[str, str]]:
+        """
+        Returns the blob hashes of the files in the version, or None if the repository is not available.
+        :param project: Name of the project
+        :param sha: Version of the project
+        :return:
+        """
+        if not os.path.isdir(self.repository(project)):
+            return None
+        if (project, sha) not in self._hashes:
+            self._hashes = {(project, sha): git_blob_hashes(self.repository(project), sha)}
+        return self._hashes[(project, sha)]
+
+    def open(self, project: str, sha: str) -> Snapshot:
+        """
+        Returns the files of the project at the given version.
+        :param project: Name of the project
+        :param sha: Version of the project
+        :return:
+        """
+        if not self.from_git:
+            return WorkingTreeSnapshot(self.repository(project))
+
+        if project not in self.readers:
+            self.close()
+            self.readers[project] = GitBlobReader(self.repository(project))
+        return GitSnapshot(self.readers[project], self.hashes(project, sha) or {})
+
+    def prefetch(self, snapshot: Snapshot, paths: Iterable[str], depth: int = 32) -> Snapshot:
+        """
+        Returns the snapshot reading ahead the files in paths on a thread pool, see PrefetchingSnapshot.
+        :param snapshot: Snapshot returned by open
+        :param paths: Paths of the files in the order they will be read
+        :param depth: Maximum number of files read ahead, if 0 the snapshot is returned as is
+        :return:
+        """
+        if not depth:
+            return snapshot
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=min(depth, 4), thread_name_prefix="prefetch")
+        return PrefetchingSnapshot(snapshot, paths, self.executor, depth)
+
+    def close(self):
+        for reader in self.readers.values():
+            reader.close()
+        self.readers = {}
+
+
+def decode_source(data: bytes) -> str:
+    """
+    Decodes the content of a source file as utf8, falling back to latin1, with universal newlines as when the file
+    is opened in text mode.
+    :param data:
+    :return:
+    """
+    try:
+        text = data.decode("utf8")
+    except UnicodeDecodeError:
+        text = data.decode("latin1")
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def source_encoding(data: bytes) -> str:
+    """
+    Returns the encoding with which decode_source decodes the content of a source file, utf8 or latin1.
+    :param data:
+    :return:
+    """
+    try:
+        data.decode("utf8")
+    except UnicodeDecodeError:
+        return "latin1"
+    return "utf8"
+
+
+def git_blob_id(data: bytes) -> str:
+    """
+    Returns the git blob hash of the content, the same as in the object database of a repository containing it.
+    :param data:
+    :return:
+    """
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
@@ -0,0 +1,29 @@
+from typing import List, Tuple
+
+import numpy as np
+
+
+def pack_strings(values: List) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encodes a list of strings in a single UTF-8 buffer and the offsets of each string in the buffer, so that they
+    can be stored in npz files without pickling. None values are stored as empty strings.
+    :param values:
+    :return: The buffer, as uint8 array, and the offsets, one more than the strings
+    """
+    encoded = [("" if v is None else str(v)).encode("utf8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.array([len(x) for x in encoded], dtype=np.int64), out=offsets[1:])
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return data, offsets
+
+
+def unpack_strings(data: np.ndarray, offsets: np.ndarray) -> List[str]:
+    """
+    Decodes the strings encoded by pack_strings.
+    :param data:
+    :param offsets:
+    :return:
+    """
+    buffer = data.tobytes()
+    offsets = offsets.tolist()
+    return [buffer[s:e].decode("utf8") for s, e in zip(offsets[:-1], offsets[1:])]
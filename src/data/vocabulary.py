@@ -0,0 +1,130 @@
+import os
+import sqlite3
+from typing import Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+
+class Vocabulary:
+    """
+    Corpus-level mapping between tokens and integer ids. The mapping is stored in SQLite, so the workers extracting
+    the content of different projects share the same ids. Ids are assigned when a token is first added and never
+    change, each process keeps the ones it has seen in memory, as well as the tokens it has looked up and not found.
+    """
+
+    def __init__(self, path: str = None):
+        """
+        :param path: Path of the SQLite file, if None the vocabulary is kept in memory
+        """
+        self.path = path
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path if path else ':memory:', timeout=60)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS tokens (id INTEGER PRIMARY KEY, token TEXT UNIQUE)")
+        self.token2id = {}
+        self.id2token = {}
+        self.missing = set()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM tokens").fetchone()[0]
+
+    def items(self, batch_size: int = 10000) -> Iterator[Tuple[int, str]]:
+        """
+        Iterates over the (id, token) of the vocabulary, in the order of the ids.
+        :param batch_size: Number of tokens read at once
+        :return:
+        """
+        last = -1
+        while True:
+            rows = self.conn.execute("SELECT id, token FROM tokens WHERE id > ? ORDER BY id LIMIT ?",
+                                     (last, batch_size)).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last = rows[-1][0]
+
+    def _fetch(self, column: str, values: List) -> None:
+        for i in range(0, len(values), 500):
+            chunk = values[i:i + 500]
+            rows = self.conn.execute(f"SELECT id, token FROM tokens WHERE {column} IN "
+                                     f"({','.join('?' * len(chunk))})", chunk).fetchall()
+            for idx, token in rows:
+                self.token2id[token] = idx
+                self.id2token[idx] = token
+
+    def add(self, tokens: Iterable[str]) -> np.ndarray:
+        """
+        Returns the ids of the tokens, assigning new ids to the tokens not in the vocabulary.
+        :param tokens:
+        :return:
+        """
+        tokens = list(tokens)
+        unknown = list({x for x in tokens if x not in self.token2id})
+        if unknown:
+            with self.conn:
+                self.conn.executemany("INSERT OR IGNORE INTO tokens (token) VALUES (?)", [(x,) for x in unknown])
+            self._fetch('token', unknown)
+            self.missing.difference_update(unknown)
+        return np.fromiter((self.token2id[x] for x in tokens), dtype=np.int32, count=len(tokens))
+
+    def lookup(self, tokens: Iterable[str]) -> np.ndarray:
+        """
+        Returns the ids of the tokens, -1 for the tokens not in the vocabulary. The tokens not found are not looked
+        up again by the process, unless it adds them.
+        :param tokens:
+        :return:
+        """
+        tokens = list(tokens)
+        unknown = list({x for x in tokens if x not in self.token2id and x not in self.missing})
+        if unknown:
+            self._fetch('token', unknown)
+            self.missing.update(x for x in unknown if x not in self.token2id)
+        return np.fromiter((self.token2id.get(x, -1) for x in tokens), dtype=np.int32, count=len(tokens))
+
+    def tokens(self, ids: Iterable[int]) -> List[str]:
+        """
+        Returns the tokens with the given ids.
+        :param ids:
+        :return:
+        """
+        ids = [int(x) for x in ids]
+        unknown = list({x for x in ids if x not in self.id2token})
+        if unknown:
+            self._fetch('id', unknown)
+        return [self.id2token[x] for x in ids]
+
+    def encode(self, text: str, update: bool = True) -> np.ndarray:
+        """
+        Returns the ids of the whitespace separated tokens of the text.
+        :param text:
+        :param update: Whether to add the unknown tokens, otherwise they are dropped
+        :return:
+        """
+        if update:
+            return self.add(text.split())
+        ids = self.lookup(text.split())
+        return ids[ids >= 0]
+
+    def encode_all(self, texts: List[str], update: bool = True) -> List[np.ndarray]:
+        """
+        Returns the ids of the tokens of each text as encode, adding the unknown tokens of all the texts at once.
+        :param texts:
+        :param update: Whether to add the unknown tokens, otherwise they are dropped
+        :return:
+        """
+        docs = [text.split() for text in texts]
+        tokens = [x for doc in docs for x in doc]
+        ids = self.add(tokens) if update else self.lookup(tokens)
+        res = np.split(ids, np.cumsum([len(doc) for doc in docs])[:-1]) if docs else []
+        return res if update else [x[x >= 0] for x in res]
+
+    @staticmethod
+    def bag_of_words(ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the distinct ids, sorted, and their counts.
+        :param ids:
+        :return:
+        """
+        ids, counts = np.unique(ids, return_counts=True)
+        return ids.astype(np.int32), counts.astype(np.int32)
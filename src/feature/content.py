@@ -1,14 +1,96 @@
-import json
+import fnmatch
+import hashlib
 import os
 import re
 from abc import abstractmethod, ABC
-from typing import Iterable, List, Union
+from typing import Iterable, List, Union, Optional, Dict, Callable, Any, Tuple
 
 import igraph
+import numpy as np
 import sourcy
+from loguru import logger
 from more_itertools import flatten
 
+from data.content_store import ContentStore
+from data.diff import IncrementalState
+from data.embedding_store import embeddings_exist, load_embeddings
 from data.graph import ArcanGraphLoader
+from data.parse_cache import ParseCache
+from data.repository import RepositorySource, decode_source, git_blob_id
+
+
+class SourceFilter:
+    """
+    Cheap checks deciding whether the content of a file is extracted, done before decoding and parsing it. A file
+    is skipped if its path matches one of the patterns (e.g. generated or vendored code), if it is larger than
+    max_size, if its header contains a generated code marker, or if it has lines longer than max_line_length
+    (e.g. minified or embedded data). If truncate is set, files larger than max_size are truncated instead.
+    """
+
+    default_patterns = ('*/generated/*', '*/generated-sources/*', '*/gen-src/*', '*/vendor/*', '*/third_party/*',
+                        '*/thirdparty/*', '*/external/*', '*Grpc.java', '*OuterClass.java', '*Proto.java')
+    default_markers = ('@Generated', 'Generated by', 'DO NOT EDIT', 'generated by the protocol buffer compiler',
+                       'auto-generated', 'Auto-generated', 'Autogenerated')
+
+    def __init__(self, patterns: Iterable[str] = None, max_size: int = 1024 * 1024, truncate: bool = False,
+                 markers: Iterable[str] = None, header_size: int = 4096, max_line_length: int = 2000):
+        """
+        :param patterns: fnmatch patterns of the paths to skip, relative to the repository root
+        :param max_size: Maximum size of the files in bytes
+        :param truncate: Whether to truncate the files larger than max_size instead of skipping them
+        :param markers: Strings marking generated code, searched in the header of the file
+        :param header_size: Number of bytes of the header
+        :param max_line_length: Maximum length of the lines in bytes
+        """
+        self.patterns = tuple(patterns) if patterns is not None else self.default_patterns
+        self.max_size = max_size
+        self.truncate = truncate
+        self.markers = tuple(x.encode("utf8") for x in (markers if markers is not None else self.default_markers))
+        self.header_size = header_size
+        self.max_line_length = max_line_length
+        self._pattern = re.compile("|".join(fnmatch.translate(x) for x in self.patterns)) if self.patterns else None
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Hash of the configuration of the filter.
+        """
+        config = [self.patterns, self.max_size, self.truncate, self.markers, self.header_size, self.max_line_length]
+        return hashlib.md5(repr(config).encode("utf8")).hexdigest()[:8]
+
+    def check_path(self, path: str) -> Optional[str]:
+        """
+        Returns the reason for skipping the file based on its path, or None.
+        :param path: Path of the file relative to the repository root
+        :return:
+        """
+        if self._pattern is not None and self._pattern.match(f"/{path}"):
+            return 'path'
+        return None
+
+    def check(self, data: bytes) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        Checks the content of a file.
+        :param data: Bytes of the file
+        :return: The bytes to parse, None if the file is skipped, and the reason for skipping or truncating it
+        """
+        reason = None
+        if len(data) > self.max_size:
+            if not self.truncate:
+                return None, 'size'
+            cut = data.rfind(b"\n", 0, self.max_size)
+            data = data[:cut if cut > 0 else self.max_size]
+            reason = 'truncated'
+
+        header = data[:self.header_size]
+        if any(marker in header for marker in self.markers):
+            return None, 'generated'
+
+        if self.max_line_length and len(data) > self.max_line_length and \
+                max(map(len, data.split(b"\n"))) > self.max_line_length:
+            return None, 'line_length'
+
+        return data, reason
 
 
 class ContentExtraction(ABC):
@@ -17,20 +99,31 @@ class ContentExtraction(ABC):
     """
 
     def __init__(self, graph_path: str = None,
-                 stopwords: Iterable = None):
+                 stopwords: Iterable = None, parse_cache: str = None, parse_cache_size: int = 2048,
+                 source_filter: SourceFilter = None, prefetch: int = 32):
         """
         :param model: Embedding model.
         :param graph_path: Path to the graph directory.
         :param out_path: Path to the output directory.
         :param stopwords: List of stopwords.
+        :param parse_cache: Path of the cache of the content extracted from each file, see ParseCache.
+        :param parse_cache_size: Maximum size of the parse cache in MB.
+        :param source_filter: Filter of the files to extract, see SourceFilter.
+        :param prefetch: Number of files read ahead while parsing, disabled if 0.
         """
 
         self.method = 'AbstractFE'
         self.graph_path = graph_path
-        if not stopwords:
-            stopwords = set()
-        self.stopwords = stopwords
+        self.stopwords = frozenset(stopwords) if stopwords else frozenset()
         self.clone = True
+        self.checkout = True
+        self.repositories = None
+        self.source = None
+        self.snapshot = None
+        self.parse_cache = ParseCache(parse_cache, parse_cache_size) if parse_cache else None
+        self.source_filter = source_filter
+        self.filtered = {}
+        self.prefetch = prefetch
 
     @abstractmethod
     def get_content(self, project: str, graph: igraph.Graph):
@@ -48,20 +141,125 @@ class ContentExtraction(ABC):
             '([A-Z][a-z]+)|_', r' \1', re.sub('([A-Z]+)', r' \1', name)
         ).split()
 
-    def extract(self, project_name: str, sha: str = None, num: str = None, clean_graph: bool = False) -> str:
+    def blob_hashes(self, project: str, sha: str) -> Optional[Dict[str, str]]:
+        """
+        Returns the blob hashes of the files of the project version, or None if the repository is not available.
+        :param project: Name of the project
+        :param sha: SHA of the project version
+        :return:
+        """
+        if self.source is None:
+            return None
+        return self.source.hashes(project, sha)
+
+    @property
+    def cache_namespace(self) -> str:
+        """
+        Namespace of the entries of the extractor in the parse cache. It changes with the stopwords, as they are
+        removed from the cached content, and with the source filter.
+        """
+        stopwords = hashlib.md5("\0".join(sorted(self.stopwords)).encode("utf8")).hexdigest()[:8]
+        if self.source_filter is not None:
+            return f"{self.method}-{stopwords}-{self.source_filter.fingerprint}"
+        return f"{self.method}-{stopwords}"
+
+    def prefetch_files(self, paths: Iterable[str]) -> None:
+        """
+        Starts reading ahead the files of the current project version that will be parsed, in the order they will
+        be parsed, see PrefetchingSnapshot. Files rejected by their path or already in the parse cache are not read.
+        :param paths: Paths of the files relative to the repository root
+        :return:
+        """
+        if self.snapshot is None or self.source is None or not self.prefetch:
+            return
+
+        def needs_read(path: str) -> bool:
+            if self.source_filter is not None and self.source_filter.check_path(path):
+                return False
+            blob = self.snapshot.blob_id(path)
+            return self.parse_cache is None or blob is None or not self.parse_cache.contains(self.cache_namespace, blob)
+
+        self.snapshot = self.source.prefetch(self.snapshot, filter(needs_read, paths), self.prefetch)
+
+    def parse_source(self, path: str, parse: Callable[[bytes], Any]) -> Optional[Any]:
+        """
+        Extracts the content of a file of the current project version. If the parse cache is enabled, the content
+        is looked up by the blob hash of the file, and it is parsed only if missing. Files rejected by the source
+        filter are not parsed, and the reason is recorded in filtered.
+        :param path: Path of the file relative to the repository root
+        :param parse: Function extracting the content from the bytes of the file
+        :return: The content of the file, or None if it does not exist or is skipped
+        """
+        if self.snapshot is None:
+            return None
+
+        if self.source_filter is not None:
+            reason = self.source_filter.check_path(path)
+            if reason:
+                self.filtered[path] = reason
+                return None
+
+        blob = self.snapshot.blob_id(path)
+        if self.parse_cache is not None and blob is not None:
+            content = self.parse_cache.get(self.cache_namespace, blob)
+            if content is not None:
+                return content
+
+        data = self.snapshot.read(path)
+        if data is None:
+            return None
+
+        if self.source_filter is not None:
+            data, reason = self.source_filter.check(data)
+            if reason:
+                self.filtered[path] = reason
+            if data is None:
+                return None
+            if reason == 'truncated':
+                # Not cached, so the truncation is recorded in every version
+                return parse(data)
+
+        if self.parse_cache is None:
+            return parse(data)
+
+        if blob is None:
+            blob = git_blob_id(data)
+            content = self.parse_cache.get(self.cache_namespace, blob)
+            if content is not None:
+                return content
+
+        content = parse(data)
+        self.parse_cache.put(self.cache_namespace, blob, content)
+        return content
+
+    def extract(self, project_name: str, sha: str = None, num: str = None, clean_graph: bool = False,
+                incremental: IncrementalState = None) -> str:
         """
         Extracts the features of the project.
         :param project_name: Name of the project.
         :param sha: SHA of the project version.
         :param num: Number of the project version in the git history.
         :param clean_graph: Whether to clean the graph.
+        :param incremental: State of the previous version of the project. If given, only the nodes that changed
+        since the previous version are extracted, the others are carried forward.
         :return:
         """
         graph_file = f"dependency-graph-{num}_{sha}.graphml"
 
         graph = ArcanGraphLoader(clean=clean_graph).load(os.path.join(self.graph_path, project_name, graph_file))
-        content = self.get_content(project_name, graph)
-        return content
+        if self.snapshot is not None:
+            self.snapshot.close()
+        self.snapshot = self.source.open(project_name, sha) if self.source else None
+        if incremental is None:
+            self.filtered = {}
+            content = self.get_content(project_name, graph)
+            return content
+
+        diff = incremental.diff(graph, self.blob_hashes(project_name, sha))
+        logger.info(f"Changes in {project_name} {num} {sha}: {diff}")
+        self.filtered = {k: v for k, v in self.filtered.items() if k in diff.unchanged}
+        content = incremental.carry_forward(self.get_content(project_name, incremental.subgraph(graph, diff)))
+        return list(content.values())
 
 
 class NameContentExtraction(ContentExtraction):
@@ -106,10 +304,24 @@ class IdentifiersContentExtraction(ContentExtraction):
     """
 
     def __init__(self, graph_path: str = None,
-                 repo_path: str = None, stopwords: Iterable = None):
-        super().__init__(graph_path, stopwords)
+                 repo_path: str = None, stopwords: Iterable = None, from_git: bool = False,
+                 parse_cache: str = None, parse_cache_size: int = 2048, source_filter: SourceFilter = None,
+                 prefetch: int = 32):
+        """
+        :param graph_path: Path to the graph directory.
+        :param repo_path: Path to the repositories directory.
+        :param stopwords: List of stopwords.
+        :param from_git: Whether to read the files from the git objects instead of checking out each version.
+        :param parse_cache: Path of the parse cache, disabled if None.
+        :param parse_cache_size: Maximum size of the parse cache in MB.
+        :param source_filter: Filter of the files to extract, disabled if None.
+        :param prefetch: Number of files read ahead while parsing, disabled if 0.
+        """
+        super().__init__(graph_path, stopwords, parse_cache, parse_cache_size, source_filter, prefetch)
         self.scp = sourcy.load("java")
         self.repositories = repo_path
+        self.source = RepositorySource(repo_path, from_git)
+        self.checkout = not from_git
         self.method = 'identifiers'
 
     def get_content(self, project: str, graph: igraph.Graph):
@@ -119,40 +331,21 @@ class IdentifiersContentExtraction(ContentExtraction):
         :param graph: Graph of the project
         :return:
         """
+        self.prefetch_files(node['filePathRelative'] for node in graph.vs)
         for node in graph.vs:
-            path = os.path.join(self.repositories, project, node['filePathRelative'])
-            if not os.path.isfile(path):
+            text = self.parse_source(node['filePathRelative'],
+                                     lambda data: " ".join(self.get_identifiers(decode_source(data))))
+            if text is None:
                 continue
 
-            identifiers = self.get_identifiers(path)
-            text = " ".join(identifiers)
             yield node['filePathRelative'], text
 
-    @staticmethod
-    def read_file(filename: str):
+    def get_identifiers(self, text: str):
         """
-        Reads the file and returns the text.
-        :param filename:
+        Returns the source code identifiers from the text of the file.
+        :param text:
         :return:
         """
-        try:
-            with open(filename, "rt", encoding="utf8") as inf:
-                text = inf.read()
-        except UnicodeDecodeError:
-            with open(filename, "rt", encoding="latin1") as inf:
-                text = inf.read()
-        except Exception:
-            return ""
-
-        return text
-
-    def get_identifiers(self, path: str):
-        """
-        Returns the source code identifiers from the file.
-        :param path:
-        :return:
-        """
-        text = self.read_file(path)
         doc = self.scp(text)
         ids = [self.split_camel(x.token) for x in doc.identifiers]
         ids = [x.lower() for x in flatten(ids)
@@ -167,10 +360,24 @@ class CommentsContentExtraction(ContentExtraction):
     """
 
     def __init__(self, graph_path: str = None,
-                 repo_path: str = None, stopwords: Iterable = None):
-        super().__init__(graph_path, stopwords)
+                 repo_path: str = None, stopwords: Iterable = None, from_git: bool = False,
+                 parse_cache: str = None, parse_cache_size: int = 2048, source_filter: SourceFilter = None,
+                 prefetch: int = 32):
+        """
+        :param graph_path: Path to the graph directory.
+        :param repo_path: Path to the repositories directory.
+        :param stopwords: List of stopwords.
+        :param from_git: Whether to read the files from the git objects instead of checking out each version.
+        :param parse_cache: Path of the parse cache, disabled if None.
+        :param parse_cache_size: Maximum size of the parse cache in MB.
+        :param source_filter: Filter of the files to extract, disabled if None.
+        :param prefetch: Number of files read ahead while parsing, disabled if 0.
+        """
+        super().__init__(graph_path, stopwords, parse_cache, parse_cache_size, source_filter, prefetch)
         self.scp = sourcy.load("java")
         self.repositories = repo_path
+        self.source = RepositorySource(repo_path, from_git)
+        self.checkout = not from_git
         self.method = 'comments'
 
     def get_content(self, project: str, graph: igraph.Graph):
@@ -180,40 +387,21 @@ class CommentsContentExtraction(ContentExtraction):
         :param graph: Graph of the project
         :return:
         """
+        self.prefetch_files(node['filePathRelative'] for node in graph.vs)
         for node in graph.vs:
-            path = os.path.join(self.repositories, project, node['filePathRelative'])
-            if not os.path.isfile(path):
+            text = self.parse_source(node['filePathRelative'],
+                                     lambda data: " ".join(self.get_identifiers(decode_source(data))))
+            if text is None:
                 continue
 
-            identifiers = self.get_identifiers(path)
-            text = " ".join(identifiers)
             yield node['filePathRelative'], text
 
-    @staticmethod
-    def read_file(filename: str):
-        """
-        Reads the file and returns the text.
-        :param filename:
-        :return:
-        """
-        try:
-            with open(filename, "rt", encoding="utf8") as inf:
-                text = inf.read()
-        except UnicodeDecodeError:
-            with open(filename, "rt", encoding="latin1") as inf:
-                text = inf.read()
-        except Exception:
-            return ""
-
-        return text
-
-    def get_identifiers(self, path: str):
+    def get_identifiers(self, text: str):
         """
-        Returns the source code identifiers from the file.
-        :param path:
+        Returns the source code identifiers from the text of the file.
+        :param text:
         :return:
         """
-        text = self.read_file(path)
         doc = self.scp(text)
         ids = [x.token for x in doc.comments]
         ids = [x.lower() for x in ids if "license" not in x.lower() and "copyright" not in x.lower()]
@@ -230,20 +418,26 @@ class JSONContentExtraction(ContentExtraction):
     def __init__(self, content_path: str = None):
         super().__init__(content_path, None)
         self.content_path = content_path
+        self.store = ContentStore(content_path)
         self.clone = False
 
     def extract(self, project_name: str, sha: str = None, num: str = None, clean_graph: bool = False) -> str:
         """
         Extracts the content of the project.
         """
-        project = f"{project_name}.json"
-        with open(os.path.join(self.content_path, project), "r") as f:
-            for line in f:
-                obj = json.loads(line)
-                if obj['sha'] == sha:
-                    return obj['content']
+        try:
+            return self.store.load(project_name, sha)
+        except KeyError:
+            raise ValueError(f"Could not find {sha} in {project_name}")
 
-        raise ValueError(f"Could not find {sha} in {project_name}")
+    def skipped(self, project_name: str, sha: str = None) -> Dict[str, str]:
+        """
+        Returns the files of the project version whose content was skipped or truncated, with the reason.
+        """
+        try:
+            return self.store.skipped(project_name, sha)
+        except KeyError:
+            raise ValueError(f"Could not find {sha} in {project_name}")
 
     @staticmethod
     def read_file(filename: str):
@@ -273,15 +467,21 @@ class PreComputedEmbeddingLoader(ContentExtraction):
     def extract(self, project_name: str, sha: str = None, num: str = None, clean_graph: bool = False) -> Union[
         str, List[float]]:
         """
-        Extracts the content of the project.
+        Extracts the embeddings of the nodes of the project version. The rows of the binary embeddings are read from
+        the memory mapped matrix without copying them, the embeddings in the older text format are parsed.
         """
-        vec_file = f"dependency-graph-{num}_{sha}.vec"
-        with open(os.path.join(self.content_path, project_name, vec_file), "r") as f:
-            for line in f:
-                node, vec = line.split(maxsplit=1)
-                yield node, vec
-
-        raise ValueError(f"Could not find {sha} in {project_name}")
+        emb_file = os.path.join(self.content_path, project_name, f"dependency-graph-{num}_{sha}.emb")
+        vec_file = os.path.join(self.content_path, project_name, f"dependency-graph-{num}_{sha}.vec")
+        if embeddings_exist(emb_file):
+            names, vectors = load_embeddings(emb_file)
+            yield from zip(names, vectors)
+        elif os.path.exists(vec_file):
+            with open(vec_file, "r") as f:
+                for line in f:
+                    node, vec = line.split(maxsplit=1)
+                    yield node, np.array(vec.split(), dtype=np.float32)
+        else:
+            raise ValueError(f"Could not find {sha} in {project_name}")
 
     def get_content(self, project: str, graph: igraph.Graph):
         pass
@@ -1,5 +1,10 @@
+import atexit
+import os
 import re
 from abc import ABC, abstractmethod
+from itertools import chain, islice
+from os.path import join, exists
+from typing import Iterable, List, Optional
 
 import fasttext as ft
 import numpy
@@ -7,9 +12,16 @@ import numpy as np
 import spacy
 import torch
 from gensim.models import KeyedVectors
+from gensim.models.fasttext import ft_ngram_hashes, load_facebook_vectors
+from loguru import logger
+from scipy.sparse import csr_matrix
 from sentence_transformers import SentenceTransformer
 from transformers import BertModel, BertTokenizer
 
+from data.embedding_cache import EmbeddingCache
+from data.strings import pack_strings, unpack_strings
+from data.vocabulary import Vocabulary
+
 
 class AbstractEmbeddingModel(ABC):
     """
@@ -28,6 +40,15 @@ class AbstractEmbeddingModel(ABC):
     def get_embedding(self, text: str) -> numpy.ndarray:
         pass
 
+    def get_embeddings(self, texts: Iterable[str], batch_size: int = 32) -> numpy.ndarray:
+        """
+        Returns the embeddings of the texts, one per row. Models that can embed several texts at once override it.
+        :param texts:
+        :param batch_size: Number of texts embedded together
+        :return:
+        """
+        return np.array([self.get_embedding(text) for text in texts])
+
 
 class BERTEmbedding(AbstractEmbeddingModel):
     """
@@ -47,16 +68,84 @@ class BERTEmbedding(AbstractEmbeddingModel):
         """
         return self.model(text).vector
 
+    def get_embeddings(self, texts: Iterable[str], batch_size: int = 32) -> numpy.ndarray:
+        """
+        Returns the embeddings of the texts, processed in batches by the spaCy pipeline.
+        :param texts:
+        :param batch_size:
+        :return:
+        """
+        return np.array([doc.vector for doc in self.model.pipe(texts, batch_size=batch_size)])
+
+
+def native_path(path: str) -> str:
+    """
+    Returns the path of the native gensim version of a word vectors model, whose arrays can be memory mapped.
+    """
+    return f"{os.path.splitext(path)[0]}.kv"
+
 
 class FastTextEmbedding(AbstractEmbeddingModel):
     """
-    Class for embedding models using FastText model.
+    Class for embedding models using FastText model. If the model was converted (see convert), the word vectors and
+    the subword vectors are memory mapped read-only, so processes loading it share the same memory.
     """
 
+    whitespace = re.compile(r'[ \t\n\v\f\r]+')
+
     def __init__(self, path: str, model: str = 'fastText'):
         super().__init__()
         self._name = f'{model}'
-        self.model = ft.load_model(path)
+        self.ngrams = None
+        if exists(native_path(path)):
+            self.model = KeyedVectors.load(native_path(path), mmap='r')
+            self.ngrams = np.load(self.ngrams_path(path), mmap_mode='r')
+        else:
+            logger.warning(f"Loading the full fastText model {path}, convert it to share it between processes")
+            self.model = ft.load_model(path)
+
+    @staticmethod
+    def ngrams_path(path: str) -> str:
+        return f"{os.path.splitext(path)[0]}.ngrams.npy"
+
+    @classmethod
+    def convert(cls, path: str) -> str:
+        """
+        Converts the fastText binary model to the native gensim format: the vectors of the words in the vocabulary,
+        composed with their subwords, and the vectors of the subword buckets, used for the other words.
+        :param path: Path of the fastText binary model
+        :return: Path of the converted model
+        """
+        fasttext = load_facebook_vectors(path)
+        words = KeyedVectors(fasttext.vector_size)
+        words.add_vectors(fasttext.index_to_key, fasttext.vectors)
+        words.min_n, words.max_n, words.bucket = fasttext.min_n, fasttext.max_n, fasttext.bucket
+        np.save(cls.ngrams_path(path), fasttext.vectors_ngrams)
+        words.save(native_path(path), separately=['vectors'])
+
+        shape = KeyedVectors.load(native_path(path), mmap='r').vectors.shape
+        if shape != (len(fasttext.index_to_key), fasttext.vector_size):
+            raise ValueError(f"Converted model {native_path(path)} has shape {shape} instead of "
+                             f"{(len(fasttext.index_to_key), fasttext.vector_size)}")
+        return native_path(path)
+
+    def get_word_vector(self, word: str) -> numpy.ndarray:
+        """
+        Returns the vector of the word, computed from the converted model as the fastText get_word_vector.
+        :param word:
+        :return:
+        """
+        if self.ngrams is None:
+            return self.model.get_word_vector(word)
+
+        index = self.model.key_to_index.get(word)
+        if index is not None:
+            return self.model.vectors[index]
+
+        hashes = ft_ngram_hashes(word, self.model.min_n, self.model.max_n, self.model.bucket)
+        if not hashes:
+            return np.zeros(self.model.vector_size, dtype=np.float32)
+        return self.ngrams[hashes].sum(axis=0) / len(hashes)
 
     def get_embedding(self, text: str) -> numpy.ndarray:
         """
@@ -64,18 +153,99 @@ class FastTextEmbedding(AbstractEmbeddingModel):
         :param text:
         :return:
         """
-        return self.model.get_sentence_vector(text)
+        if self.ngrams is None:
+            return self.model.get_sentence_vector(text)
 
+        return self.get_embeddings([text])[0]
 
-class W2VEmbedding(AbstractEmbeddingModel):
+    def get_embeddings(self, texts: Iterable[str], batch_size: int = 32) -> numpy.ndarray:
+        """
+        Returns the embeddings of the texts. With the converted model they are computed as get_sentence_vector
+        does: the mean of the unit vectors of the words, skipping the words whose vector is zero.
+        :param texts:
+        :param batch_size:
+        :return:
+        """
+        if self.ngrams is None:
+            return super().get_embeddings(texts, batch_size)
+
+        texts = list(texts)
+        embeddings = np.zeros((len(texts), self.model.vector_size), dtype=np.float32)
+        for i, text in enumerate(texts):
+            words = [w for w in self.whitespace.split(text) if w]
+            if not words:
+                continue
+            vectors = np.array([self.get_word_vector(w) for w in words], dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1)
+            nonzero = norms > 0
+            if nonzero.any():
+                embeddings[i] = (vectors[nonzero] / norms[nonzero, None]).mean(axis=0)
+
+        return embeddings
+
+
+class VocabularyFastTextEmbedding(AbstractEmbeddingModel):
     """
-    Class for embedding models using Word2Vec model.
+    Class for fastText embeddings computed from a table of the vectors of the tokens in the corpus vocabulary, created
+    with export, instead of the full model. The embeddings are the same as get_sentence_vector. Words that are not in
+    the table are logged and skipped, or embedded with the fallback model if one is given, loaded the first time it is
+    needed.
     """
 
-    def __init__(self, path: str, model: str = 'W2V-Unk'):
+    def __init__(self, path: str, model: str = 'fastText', fallback: str = None):
+        """
+        :param path: Path of the table, see export
+        :param model: Name of the embedding
+        :param fallback: Path of the fastText model used for the words not in the table, see FastTextEmbedding. None
+        to skip them
+        """
         super().__init__()
         self._name = f'{model}'
-        self.model = KeyedVectors.load_word2vec_format(path, binary=True)
+        self.model = np.load(f"{path}.vectors.npy", mmap_mode='r')
+        with np.load(f"{path}.tokens.npz") as data:
+            tokens = unpack_strings(data['tokens_data'], data['tokens_offsets'])
+            self.nonzero = data['nonzero']
+        self.token2row = {token: row for row, token in enumerate(tokens)}
+        self.fallback = fallback
+        self.fallback_model = None
+        self.misses = 0
+        self.missed = set()
+
+    @staticmethod
+    def export(model_path: str, vocabulary: Vocabulary, path: str, extra: Iterable[str] = ()) -> int:
+        """
+        Writes the table of the unit vectors of the tokens of the vocabulary, computed with the fastText model,
+        including the tokens that are not in the vocabulary of the model.
+        :param model_path: Path of the fastText model, see FastTextEmbedding
+        :param vocabulary: Vocabulary of the corpus
+        :param path: Path of the table, without extension
+        :param extra: Other tokens to add to the table, e.g. the ones of the labels and keywords
+        :return: Number of tokens in the table
+        """
+        model = FastTextEmbedding(model_path)
+        extra = list(dict.fromkeys(extra))
+        extra = [x for x, i in zip(extra, vocabulary.lookup(extra)) if i < 0]
+        n = len(vocabulary)
+        dim = len(model.get_word_vector(""))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.vectors.tmp.npy"
+        vectors = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=(n + len(extra), dim))
+        nonzero = np.zeros(n + len(extra), dtype=bool)
+        tokens = []
+        for row, token in enumerate(chain((x for _, x in islice(vocabulary.items(), n)), extra)):
+            vector = np.asarray(model.get_word_vector(token), dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            if norm > 0:
+                vectors[row] = vector / norm
+                nonzero[row] = True
+            tokens.append(token)
+
+        vectors.flush()
+        del vectors
+        os.replace(tmp, f"{path}.vectors.npy")
+        tokens_data, tokens_offsets = pack_strings(tokens)
+        np.savez(f"{path}.tokens.npz", tokens_data=tokens_data, tokens_offsets=tokens_offsets, nonzero=nonzero)
+        return len(tokens)
 
     def get_embedding(self, text: str) -> numpy.ndarray:
         """
@@ -83,33 +253,132 @@ class W2VEmbedding(AbstractEmbeddingModel):
         :param text:
         :return:
         """
-        embeddings = []
-        if not text:
-            embeddings.append(np.zeros(self.model.vector_size))
-        for word in str(text).split():
-            if word in self.model:
-                embeddings.append(self.model[word])
-            else:
-                embeddings.append(np.zeros(self.model.vector_size))
-        return numpy.mean(embeddings, axis=0)
+        return self.get_embeddings([text])[0]
 
+    def get_embeddings(self, texts: Iterable[str], batch_size: int = 1024) -> numpy.ndarray:
+        """
+        Returns the embeddings of the texts, the mean of the unit vectors of their words, skipping the words whose
+        vector is zero. The vectors in the table are averaged for a batch of texts at once.
+        :param texts:
+        :param batch_size: Number of texts averaged together
+        :return:
+        """
+        texts = list(texts)
+        embeddings = np.zeros((len(texts), self.model.shape[1]), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            docs, rows, missing = [], [], []
+            for i, text in enumerate(texts[start:start + batch_size]):
+                for word in FastTextEmbedding.whitespace.split(text):
+                    if not word:
+                        continue
+                    row = self.token2row.get(word)
+                    if row is None:
+                        missing.append((i, word))
+                    elif self.nonzero[row]:
+                        docs.append(i)
+                        rows.append(row)
+
+            n = min(batch_size, len(texts) - start)
+            counts = np.bincount(docs, minlength=n).astype(np.float32)
+            sums = np.asarray(csr_matrix((np.ones(len(rows), dtype=np.float32), (docs, rows)),
+                                         shape=(n, len(self.model))) @ self.model)
+            self.misses += len(missing)
+            for i, word in missing:
+                vector = self.fallback_vector(word)
+                if vector is not None:
+                    sums[i] += vector
+                    counts[i] += 1
+
+            embedded = counts > 0
+            embeddings[start:start + n][embedded] = sums[embedded] / counts[embedded, None]
+
+        return embeddings
+
+    def fallback_vector(self, word: str) -> Optional[numpy.ndarray]:
+        """
+        Returns the unit vector of a word that is not in the table, or None if it is zero or there is no fallback.
+        """
+        if word not in self.missed:
+            self.missed.add(word)
+            logger.debug(f"Word not in the vector table: {word}")
+        if self.fallback is None:
+            return None
+        if self.fallback_model is None:
+            self.fallback_model = FastTextEmbedding(self.fallback)
+
+        vector = np.asarray(self.fallback_model.get_word_vector(word), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+
+class W2VEmbedding(AbstractEmbeddingModel):
+    """
+    Class for embedding models using Word2Vec model. If the model was converted to the native gensim format (see
+    convert), it is memory mapped read-only, so processes loading it share the same memory.
+    """
+
+    def __init__(self, path: str, model: str = 'W2V-Unk'):
+        super().__init__()
+        self._name = f'{model}'
+        if exists(native_path(path)):
+            self.model = KeyedVectors.load(native_path(path), mmap='r')
+        else:
+            self.model = KeyedVectors.load_word2vec_format(path, binary=True)
+
+    @staticmethod
+    def convert(path: str) -> str:
+        """
+        Converts the binary word2vec model to the native gensim format, which is memory mapped when loaded.
+        :param path: Path of the word2vec model
+        :return: Path of the converted model
+        """
+        KeyedVectors.load_word2vec_format(path, binary=True).save(native_path(path), separately=['vectors'])
+        return native_path(path)
 
-class SplitW2VEmbedding(W2VEmbedding):
     def get_embedding(self, text: str) -> numpy.ndarray:
         """
         Returns the embedding of the text.
         :param text:
         :return:
         """
-        embeddings = []
-        if not text:
-            embeddings.append(np.zeros(self.model.vector_size))
-        for word in self.split_camel(str(text)):
-            if word in self.model:
-                embeddings.append(self.model[word])
-            else:
-                embeddings.append(np.zeros(self.model.vector_size))
-        return numpy.mean(embeddings, axis=0)
+        return self.get_embeddings([text])[0]
+
+    def get_embeddings(self, texts: Iterable[str], batch_size: int = 1024) -> numpy.ndarray:
+        """
+        Returns the embeddings of the texts, the mean of the vectors of their words. Words not in the vocabulary
+        count as zero vectors, texts without words are embedded as zero vectors. The words of each batch of texts
+        are mapped to their row in the vectors matrix at once, and the rows are averaged per text.
+        :param texts:
+        :param batch_size: Number of texts averaged together
+        :return:
+        """
+        texts = list(texts)
+        embeddings = np.zeros((len(texts), self.model.vector_size), dtype=np.float32)
+        key_to_index = self.model.key_to_index
+        for start in range(0, len(texts), batch_size):
+            words = [self.tokenize(text) for text in texts[start:start + batch_size]]
+            lengths = np.fromiter((len(x) for x in words), dtype=np.int64, count=len(words))
+            ids = np.fromiter((key_to_index.get(w, -1) for x in words for w in x), dtype=np.int64,
+                              count=lengths.sum())
+            docs = np.repeat(np.arange(len(words)), lengths)
+            known = ids >= 0
+            if not known.any():
+                continue
+
+            # Sparse (texts x vocabulary) matrix of the word weights, so the means are a single product
+            docs = docs[known]
+            weights = csr_matrix((1 / lengths[docs], (docs, ids[known])), shape=(len(words), len(self.model.vectors)))
+            embeddings[start:start + len(words)] = weights @ self.model.vectors
+
+        return embeddings
+
+    def tokenize(self, text: str) -> List[str]:
+        return str(text).split() if text else []
+
+
+class SplitW2VEmbedding(W2VEmbedding):
+    def tokenize(self, text: str) -> List[str]:
+        return self.split_camel(str(text)) if text else []
 
     def split_camel(self, name: str):
         return re.sub(
@@ -119,15 +388,31 @@ class SplitW2VEmbedding(W2VEmbedding):
 
 class HuggingFaceEmbedding(AbstractEmbeddingModel):
     """
-    Class for embedding models using HuggingFace.
+    Class for embedding models using HuggingFace. If chunk_size is set, long texts are split into windows of at most
+    chunk_size tokens that are embedded separately and pooled, otherwise each text is embedded as a single sequence.
     """
 
-    def __init__(self, name, model):
+    def __init__(self, name, model, chunk_size: int = None, max_tokens: int = None, pooling: str = 'mean'):
+        """
+        :param name: Name of the embedding
+        :param model: Name or path of the pretrained model
+        :param chunk_size: Maximum number of tokens of each window, None to disable the windowing. At most the
+        position limit of the model
+        :param max_tokens: Maximum number of tokens embedded for each text, the rest is ignored. None for no limit
+        :param pooling: How the windows of a text are pooled: 'mean' or 'weighted' by their number of tokens
+        """
         super().__init__()
         self._name = f'{name}'
         do_lower_case = True
         self.model = BertModel.from_pretrained(model)
         self.tokenizer = BertTokenizer.from_pretrained(model, do_lower_case=do_lower_case)
+        if pooling not in ('mean', 'weighted'):
+            raise ValueError(f"Unknown pooling {pooling}")
+        if chunk_size is not None:
+            chunk_size = min(chunk_size, self.model.config.max_position_embeddings - 2)
+        self.chunk_size = chunk_size
+        self.max_tokens = max_tokens
+        self.pooling = pooling
 
     def get_embedding(self, text: str) -> numpy.ndarray:
         """
@@ -135,10 +420,87 @@ class HuggingFaceEmbedding(AbstractEmbeddingModel):
         :param text:
         :return:
         """
-        input_ids = torch.tensor(self.tokenizer.encode(text)).unsqueeze(0)  # Batch size 1
-        outputs = self.model(input_ids)
-        last_hidden_states = outputs[0]  # The last hidden-state is the first element of the output tuple
-        return last_hidden_states.mean(1).detach().numpy()[0]
+        return self.get_embeddings([text])[0]
+
+    def get_embeddings(self, texts: Iterable[str], batch_size: int = 32) -> numpy.ndarray:
+        """
+        Returns the embeddings of the texts, the mean of the last hidden states of their tokens. When windowing is
+        enabled, the embedding of a text is the pooling of the embeddings of its windows.
+        :param texts:
+        :param batch_size: Number of sequences (texts or windows) run together
+        :return:
+        """
+        tokens = [self.tokenize(text) for text in texts]
+        if self.chunk_size is None:
+            sequences = [self.with_special_tokens(x) for x in tokens]
+            return self.embed_sequences(sequences, batch_size)
+
+        sequences, owners, weights = [], [], []
+        for i, x in enumerate(tokens):
+            for start in range(0, max(len(x), 1), self.chunk_size):
+                window = x[start:start + self.chunk_size]
+                sequences.append(self.with_special_tokens(window))
+                owners.append(i)
+                weights.append(len(window) if self.pooling == 'weighted' else 1)
+
+        windows = self.embed_sequences(sequences, batch_size)
+        owners = np.array(owners, dtype=np.int64)
+        weights = np.maximum(np.array(weights, dtype=np.float32), 1)
+        embeddings = np.zeros((len(tokens), windows.shape[1]), dtype=np.float32)
+        np.add.at(embeddings, owners, windows * weights[:, None])
+        return embeddings / np.bincount(owners, weights=weights, minlength=len(tokens))[:, None].astype(np.float32)
+
+    def tokenize(self, text: str) -> List[int]:
+        """
+        Returns the token ids of the text, without special tokens, truncated to max_tokens. Only a prefix of the text
+        cut at a whitespace is tokenized, doubled until it has enough tokens, so the rest of long texts is never
+        tokenized. The words are tokenized separately, so the ids are the same as the ones of the whole text.
+        :param text:
+        :return:
+        """
+        if self.max_tokens is None:
+            return self.tokenizer.encode(text, add_special_tokens=False)
+
+        size = self.max_tokens * 8
+        while size < len(text):
+            end = max(text.rfind(x, 0, size) for x in ' \t\n\r')
+            if end > 0:
+                ids = self.tokenizer.encode(text[:end], add_special_tokens=False)
+                if len(ids) >= self.max_tokens:
+                    return ids[:self.max_tokens]
+            size *= 2
+        return self.tokenizer.encode(text, add_special_tokens=False)[:self.max_tokens]
+
+    def with_special_tokens(self, ids: List[int]) -> List[int]:
+        return [self.tokenizer.cls_token_id] + ids + [self.tokenizer.sep_token_id]
+
+    def embed_sequences(self, sequences: List[List[int]], batch_size: int = 32) -> numpy.ndarray:
+        """
+        Returns the mean of the last hidden states of each sequence of token ids. Sequences are sorted by length and
+        batched together, so each batch is padded only to its longest sequence.
+        :param sequences: Token ids, including the special tokens
+        :param batch_size:
+        :return:
+        """
+        order = sorted(range(len(sequences)), key=lambda i: len(sequences[i]))
+        embeddings = np.zeros((len(sequences), self.model.config.hidden_size), dtype=np.float32)
+
+        with torch.inference_mode():
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                length = max(len(sequences[i]) for i in batch)
+                input_ids = torch.full((len(batch), length), self.tokenizer.pad_token_id, dtype=torch.long)
+                attention_mask = torch.zeros((len(batch), length), dtype=torch.long)
+                for row, i in enumerate(batch):
+                    input_ids[row, :len(sequences[i])] = torch.tensor(sequences[i])
+                    attention_mask[row, :len(sequences[i])] = 1
+
+                outputs = self.model(input_ids, attention_mask=attention_mask)
+                last_hidden_states = outputs[0]  # The last hidden-state is the first element of the output tuple
+                mask = attention_mask.unsqueeze(-1).to(last_hidden_states.dtype)
+                embeddings[batch] = ((last_hidden_states * mask).sum(1) / mask.sum(1)).numpy()
+
+        return embeddings
 
 
 class SentenceTransformersEmbedding(AbstractEmbeddingModel):
@@ -156,3 +518,77 @@ class SentenceTransformersEmbedding(AbstractEmbeddingModel):
         """
         embeddings = self.model.encode(text)
         return embeddings
+
+    def get_embeddings(self, texts: Iterable[str], batch_size: int = 32) -> numpy.ndarray:
+        """
+        Returns the embeddings of the texts, encoded in batches of texts of similar length.
+        :param texts:
+        :param batch_size:
+        :return:
+        """
+        return self.model.encode(list(texts), batch_size=batch_size, convert_to_numpy=True)
+
+
+class CachedEmbedding(AbstractEmbeddingModel):
+    """
+    Wraps an embedding model with a persistent cache of the embeddings of the texts, see EmbeddingCache. Cached
+    texts are served without running the model. The cache of each model is stored in a separate folder, and is
+    closed by close or when the process exits.
+    """
+
+    def __init__(self, model: AbstractEmbeddingModel, path: str, max_size: int = 1024):
+        """
+        :param model: Embedding model
+        :param path: Folder of the cache
+        :param max_size: Maximum size of the cache of the model in MB
+        """
+        super().__init__()
+        self._name = model.name
+        self.embedding = model
+        self.model = model.model
+        self.cache = EmbeddingCache(join(path, re.sub(r'[^\w.-]', '_', model.name)), max_size)
+        atexit.register(self.close)
+
+    def get_embedding(self, text: str) -> numpy.ndarray:
+        """
+        Returns the embedding of the text.
+        :param text:
+        :return:
+        """
+        return self.get_embeddings([text])[0]
+
+    def get_embeddings(self, texts: Iterable[str], batch_size: int = 32) -> numpy.ndarray:
+        """
+        Returns the embeddings of the texts, computing with the model only the ones not in the cache.
+        :param texts:
+        :param batch_size:
+        :return:
+        """
+        texts = list(texts)
+        found = self.cache.get(texts)
+        missing = list(dict.fromkeys(text for text in texts if text not in found))
+        if missing:
+            embeddings = np.asarray(self.embedding.get_embeddings(missing, batch_size), dtype=np.float32)
+            self.cache.put(missing, embeddings)
+            found.update(zip(missing, embeddings))
+
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([found[text] for text in texts])
+
+    def close(self) -> None:
+        """
+        Writes the pending access times of the cache and closes it.
+        """
+        self.cache.close()
+
+
+def cached_embedding(model: AbstractEmbeddingModel, path: str = None, max_size: int = 1024) -> AbstractEmbeddingModel:
+    """
+    Returns the model wrapped with a persistent cache of its embeddings, or the model itself if path is None.
+    :param model: Embedding model
+    :param path: Folder of the cache, see CachedEmbedding
+    :param max_size: Maximum size of the cache of the model in MB
+    :return:
+    """
+    return CachedEmbedding(model, path, max_size) if path else model
@@ -1,17 +1,20 @@
-import json
 import os
 import re
 from abc import abstractmethod, ABC
 # import sourcy
-from typing import Iterable
+from typing import Iterable, Optional, Dict
 
 import igraph
 import numpy as np
-import pandas as pd
-from more_itertools import flatten
+from loguru import logger
+from more_itertools import flatten, chunked
 
+from data.content_store import ContentStore
+from data.embedding_store import EmbeddingWriter
+from data.diff import IncrementalState
 from data.graph import ArcanGraphLoader
 from feature.embedding import AbstractEmbeddingModel
+from data.repository import RepositorySource, decode_source
 from utils import check_dir
 
 
@@ -21,21 +24,28 @@ class FeatureExtraction(ABC):
     """
 
     def __init__(self, model: AbstractEmbeddingModel, graph_path: str = None, out_path: str = None,
-                 stopwords: Iterable = None):
+                 stopwords: Iterable = None, batch_size: int = 32, dtype: str = 'float32'):
         """
         :param model: Embedding model.
         :param graph_path: Path to the graph directory.
         :param out_path: Path to the output directory.
         :param stopwords: List of stopwords.
+        :param batch_size: Number of nodes embedded together.
+        :param dtype: Type of the saved embeddings, float32 or float16.
         """
         self.nlp = model
         self.method = 'AbstractFE'
         self.graph_path = graph_path
         self.out_path = out_path
-        if not stopwords:
-            stopwords = set()
-        self.stopwords = stopwords
+        self.stopwords = frozenset(stopwords) if stopwords else frozenset()
         self.clone = True
+        self.checkout = True
+        self.repositories = None
+        self.source = None
+        self.snapshot = None
+        self.result_key = 'filePathRelative'
+        self.batch_size = batch_size
+        self.dtype = dtype
 
     @abstractmethod
     def get_embeddings(self, project: str, graph: igraph.Graph):
@@ -54,40 +64,68 @@ class FeatureExtraction(ABC):
         ).split()
 
     @staticmethod
-    def save_features(features, path: str, file: str):
+    def save_features(features, path: str, file: str, dtype: str = 'float32'):
         """
-        Saves the features in the path as a csv file.
-        The first column is the file name and the other columns are the embedding.
-        :param features: Features to save.
+        Saves the features in the path as a binary matrix, one row per node, and the names of the nodes, see
+        EmbeddingWriter. The features are written as they are computed.
+        :param features: Features to save, as (name, cleaned, embedding).
         :param path:
         :param file:
+        :param dtype: Type of the saved values, float32 or float16.
         :return:
         """
-        out = os.path.join(path, file)
-        df = pd.DataFrame(features, columns=['name', 'cleaned', 'embedding'])
-        df['embedding'] = df['embedding'].apply(lambda x: x.tolist())
-        df = pd.concat([df, df['embedding'].apply(pd.Series)], axis=1)
-        df.drop(columns=['embedding', 'cleaned'], inplace=True)
-        df.to_csv(out, sep=' ', index=False, header=False)
+        with EmbeddingWriter(os.path.join(path, file), dtype) as writer:
+            for name, _, embedding in features:
+                writer.write(name, embedding)
 
-    def extract(self, project_name: str, sha: str = None, num: str = None, clean_graph: bool = False):
+    def blob_hashes(self, project: str, sha: str) -> Optional[Dict[str, str]]:
+        """
+        Returns the blob hashes of the files of the project version, or None if the repository is not available.
+        :param project: Name of the project
+        :param sha: SHA of the project version
+        :return:
+        """
+        if self.source is None:
+            return None
+        return self.source.hashes(project, sha)
+
+    def compute_features(self, project_name: str, sha: str, num: str, graph: igraph.Graph,
+                         incremental: IncrementalState = None):
+        """
+        Computes the features of the graph. If the state of the previous version is given, only the nodes that
+        changed are embedded, the others are carried forward.
+        """
+        if self.snapshot is not None:
+            self.snapshot.close()
+        self.snapshot = self.source.open(project_name, sha) if self.source else None
+        if incremental is None:
+            return self.get_embeddings(project_name, graph)
+
+        diff = incremental.diff(graph, self.blob_hashes(project_name, sha))
+        logger.info(f"Changes in {project_name} {num} {sha}: {diff}")
+        features = incremental.carry_forward(self.get_embeddings(project_name, incremental.subgraph(graph, diff)))
+        return list(features.values())
+
+    def extract(self, project_name: str, sha: str = None, num: str = None, clean_graph: bool = False,
+                incremental: IncrementalState = None):
         """
         Extracts the features of the project.
         :param project_name: Name of the project.
         :param sha: SHA of the project version.
         :param num: Number of the project version in the git history.
         :param clean_graph: Whether to clean the graph.
+        :param incremental: State of the previous version of the project, see compute_features.
         :return:
         """
         graph_file = f"dependency-graph-{num}_{sha}.graphml"
-        features_name = f"dependency-graph-{num}_{sha}.vec"
+        features_name = f"dependency-graph-{num}_{sha}.emb"
 
         graph = ArcanGraphLoader(clean=clean_graph).load(os.path.join(self.graph_path, project_name, graph_file))
         features_out = os.path.join(self.out_path, "embedding", self.method, self.nlp.name, project_name)
-        features = self.get_embeddings(project_name, graph)
+        features = self.compute_features(project_name, sha, num, graph, incremental)
         check_dir(features_out)
 
-        self.save_features(features, features_out, features_name)
+        self.save_features(features, features_out, features_name, self.dtype)
 
 
 class NameFeatureExtraction(FeatureExtraction):
@@ -96,10 +134,11 @@ class NameFeatureExtraction(FeatureExtraction):
     """
 
     def __init__(self, model: AbstractEmbeddingModel, graph_path: str = None, out_path: str = None,
-                 stopwords: str = None):
-        super().__init__(model, graph_path, out_path, stopwords)
+                 stopwords: str = None, batch_size: int = 32, dtype: str = 'float32'):
+        super().__init__(model, graph_path, out_path, stopwords, batch_size, dtype)
         self.method = 'name'
         self.clone = False
+        self.result_key = 'name'
 
     def get_embeddings(self, project: str, graph: igraph.Graph):
         """
@@ -108,15 +147,19 @@ class NameFeatureExtraction(FeatureExtraction):
         :param graph: Graph of the project
         :return:
         """
-        for node in graph.vs:
-            name = node['name']
-            name, clean = self.name_to_sentence(name)
+        for nodes in chunked(graph.vs, self.batch_size):
+            names = []
+            for node in nodes:
+                name, clean = self.name_to_sentence(node['name'])
 
-            if not clean:
-                clean = node['name']
+                if not clean:
+                    clean = node['name']
 
-            embedding = self.nlp.get_embedding(clean)
-            yield name, clean, embedding
+                names.append((name, clean))
+
+            embeddings = self.nlp.get_embeddings([clean for _, clean in names], self.batch_size)
+            for (name, clean), embedding in zip(names, embeddings):
+                yield name, clean, embedding
 
     def name_to_sentence(self, name: str):
         tokens = name.split(".")
@@ -135,11 +178,15 @@ class IdentifiersFeatureExtraction(FeatureExtraction):
     """
 
     def __init__(self, model: AbstractEmbeddingModel, graph_path: str = None, out_path: str = None,
-                 repo_path: str = None, preprocess: bool = True, stopwords: Iterable = None):
-        super().__init__(model, graph_path, out_path, stopwords)
+                 repo_path: str = None, preprocess: bool = True, stopwords: Iterable = None, from_git: bool = False,
+                 prefetch: int = 32, batch_size: int = 32, dtype: str = 'float32'):
+        super().__init__(model, graph_path, out_path, stopwords, batch_size, dtype)
+        self.prefetch = prefetch
         self.scp = None  # sourcy.load("java")
         self.preprocess = preprocess
         self.repositories = repo_path
+        self.source = RepositorySource(repo_path, from_git)
+        self.checkout = not from_git
         self.method = 'identifiers'
 
     def get_embeddings(self, project: str, graph: igraph.Graph):
@@ -149,37 +196,33 @@ class IdentifiersFeatureExtraction(FeatureExtraction):
         :param graph: Graph of the project
         :return:
         """
-        for node in graph.vs:
-            path = os.path.join(self.repositories, project, node['filePathRelative'])
+        self.snapshot = self.source.prefetch(self.snapshot, [node['filePathRelative'] for node in graph.vs],
+                                             self.prefetch)
+        for nodes in chunked(graph.vs, self.batch_size):
+            batch = []
+            for node in nodes:
+                path = os.path.join(self.repositories, project, node['filePathRelative'])
 
-            if not os.path.isfile(path):
-                continue
-
-            identifiers = self.get_identifiers(path)
-            text = " ".join(identifiers)
-            embedding = self.nlp.get_embedding(text)
+                data = self.snapshot.read(node['filePathRelative'])
+                if data is None:
+                    continue
 
-            yield node['filePathRelative'], path, embedding
+                identifiers = self.get_identifiers(decode_source(data))
+                batch.append((node['filePathRelative'], path, " ".join(identifiers)))
 
-    @staticmethod
-    def read_file(filename: str):
-        """
-        Reads the file and returns the text.
-        :param filename:
-        :return:
-        """
-        with open(filename, "rt", encoding="utf8") as inf:
-            text = inf.read()
+            if not batch:
+                continue
 
-        return text
+            embeddings = self.nlp.get_embeddings([text for _, _, text in batch], self.batch_size)
+            for (file, path, _), embedding in zip(batch, embeddings):
+                yield file, path, embedding
 
-    def get_identifiers(self, path: str):
+    def get_identifiers(self, text: str):
         """
-        Returns the source code identifiers from the file.
-        :param path:
+        Returns the source code identifiers from the text of the file.
+        :param text:
         :return:
         """
-        text = self.read_file(path)
         doc = self.scp(text)
         ids = [self.split_camel(x.token) for x in doc.identifiers]
         ids = [x.lower() for x in flatten(ids)
@@ -194,35 +237,41 @@ class MethodFeatureExtraction(FeatureExtraction):
     """
 
     def __init__(self, model: AbstractEmbeddingModel, graph_path: str = None, out_path: str = None,
-                 repo_path: str = None, methods_path: str = None, preprocess: bool = True, stopwords: Iterable = None):
-        super().__init__(model, graph_path, out_path, stopwords)
+                 repo_path: str = None, methods_path: str = None, preprocess: bool = True, stopwords: Iterable = None,
+                 from_git: bool = False, dtype: str = 'float32'):
+        super().__init__(model, graph_path, out_path, stopwords, dtype=dtype)
         self.preprocess = preprocess
         self.repositories = repo_path
+        # The methods are read from the content store, the repositories only give the blob hashes of the files
+        self.source = RepositorySource(repo_path, from_git) if repo_path else None
         self.method = 'methods'
         self.methods = {}
         self.methods_path = methods_path
+        self.store = ContentStore(methods_path)
         self.clone = False
 
-    def extract(self, project_name: str, sha: str = None, num: str = None, clean_graph: bool = False):
+    def extract(self, project_name: str, sha: str = None, num: str = None, clean_graph: bool = False,
+                incremental: IncrementalState = None):
         """
         Extracts the features of the project.
         :param project_name: Name of the project.
         :param sha: SHA of the project version.
         :param num: Number of the project version in the git history.
         :param clean_graph: Whether to clean the graph.
+        :param incremental: State of the previous version of the project, see compute_features.
         :return:
         """
 
         graph_file = f"dependency-graph-{num}_{sha}.graphml"
-        features_name = f"dependency-graph-{num}_{sha}.vec"
+        features_name = f"dependency-graph-{num}_{sha}.emb"
 
         graph = ArcanGraphLoader(clean=clean_graph).load(os.path.join(self.graph_path, project_name, graph_file))
         features_out = os.path.join(self.out_path, "embedding", self.method, self.nlp.name, project_name)
-        self.methods = self.load_methods(os.path.join(self.methods_path, f'{project_name}.json'), num, sha)
-        features = self.get_embeddings(project_name, graph)
+        self.methods = self.store.load(project_name, sha, num)
+        features = self.compute_features(project_name, sha, num, graph, incremental)
         check_dir(features_out)
 
-        self.save_features(features, features_out, features_name)
+        self.save_features(features, features_out, features_name, self.dtype)
 
     def get_embeddings(self, project: str, graph: igraph.Graph):
         """
@@ -243,11 +292,3 @@ class MethodFeatureExtraction(FeatureExtraction):
 
             embedding = np.mean(embeddings, axis=0)
             yield node['filePathRelative'], '', embedding
-
-    @staticmethod
-    def load_methods(file, num, sha):
-        with open(file, 'r') as f:
-            for line in f:
-                obj = json.loads(line)
-                if obj['num'] == num and obj['sha'] == sha:
-                    return obj['content']
@@ -1,15 +1,15 @@
-import os
+import re
 from collections import deque
-from typing import List, Iterable
+from typing import List, Iterable, Optional
 
 import igraph
 import tree_sitter
-from hydra import initialize, compose
-from loguru import logger
-from tree_sitter import Parser
+from more_itertools import flatten
 from tree_sitter.binding import Tree, Node
 
-from feature.content import ContentExtraction
+from data.repository import RepositorySource, source_encoding
+from feature import parsers
+from feature.content import ContentExtraction, SourceFilter
 
 
 class Token(object):
@@ -54,17 +54,17 @@ class MethodContentExtraction(ContentExtraction):
     """
 
     def __init__(self, graph_path: str = None,
-                 repo_path: str = None, stopwords: Iterable = None):
-        super().__init__(graph_path, stopwords)
+                 repo_path: str = None, stopwords: Iterable = None, from_git: bool = False,
+                 parse_cache: str = None, parse_cache_size: int = 2048, languages_path: str = None,
+                 source_filter: SourceFilter = None, prefetch: int = 32):
+        super().__init__(graph_path, stopwords, parse_cache, parse_cache_size, source_filter, prefetch)
 
-        # Dirty fix for loading the tree-sitter language file
-        with initialize(version_base=None, config_path="../../src/conf/"):
-            cfg = compose(config_name='annotation.yaml')
-        lang = tree_sitter.Language(f'{cfg.base_path}/languages.so', 'java')
-        self.parser = Parser()
-        self.parser.set_language(lang)
+        self.language = parsers.get_language('java', languages_path)
+        self.parser = parsers.get_parser('java', languages_path)
 
         self.repositories = repo_path
+        self.source = RepositorySource(repo_path, from_git)
+        self.checkout = not from_git
         self.method = 'methods'
 
     def get_content(self, project: str, graph: igraph.Graph):
@@ -74,39 +74,34 @@ class MethodContentExtraction(ContentExtraction):
         :param graph: Graph of the project
         :return:
         """
+        self.prefetch_files(node['filePathRelative'] for node in graph.vs)
         for node in graph.vs:
-            path = os.path.join(self.repositories, project, node['filePathRelative'])
-            if not os.path.isfile(path):
+            methods = self.parse_source(node['filePathRelative'], self.get_methods)
+            if methods is None:
                 continue
 
-            methods = self.get_methods(path)
             yield node['filePathRelative'], methods
 
-    @staticmethod
-    def read_file(filename: str):
+    def get_methods(self, file_content: bytes):
         """
-        Reads the file and returns the text.
-        :param filename:
+        Returns the methods from the content of the file.
+        :param file_content:
         :return:
         """
-        try:
-            with open(filename, "rb") as inf:
-                text = inf.read()
-        except Exception as e:
-            logger.error(f"Error reading file {filename}: {e}")
-            return ""
-
-        return text
+        tree = self.parser.parse(file_content)
+        encoding = source_encoding(file_content)
+        tokens = self._traverse(file_content, tree, encoding)
+        return self._methods(file_content, tokens, encoding)
 
-    def get_methods(self, path: str):
+    @staticmethod
+    def _methods(file_content: bytes, tokens: List[Token], encoding: str = "utf8"):
         """
-        Returns the source code identifiers from the file.
-        :param path:
+        Returns the methods of the file, with their comments, from the list of tokens.
+        :param file_content:
+        :param tokens:
+        :param encoding: Encoding of the file, see source_encoding
         :return:
         """
-        file_content = self.read_file(path)
-        tree = self.parser.parse(file_content)
-        tokens = self._traverse(file_content, tree)
         methods = []
         method = {}
         i = 0
@@ -135,7 +130,7 @@ class MethodContentExtraction(ContentExtraction):
                 comments.append(end)
                 pairs = list(zip(comments[::2], comments[1::2]))
                 body = [file_content[s:e] for s, e in pairs]
-                body = ' '.join([t.decode("utf8") for t in body])
+                body = ' '.join([t.decode(encoding) for t in body])
                 method['body'] = ' '.join(body.split())
                 methods.append(method)
             method = {}
@@ -155,11 +150,12 @@ class MethodContentExtraction(ContentExtraction):
         annotations = node.type
         return token, annotations
 
-    def _traverse(self, code: bytes, tree: Tree) -> List[Token]:
+    def _traverse(self, code: bytes, tree: Tree, encoding: str = "utf8") -> List[Token]:
         """
         Post-order tree traversal that returns a list of tokens with their annotations
         :param code: A byte string representation of the code
         :param tree: The tree representation of the code
+        :param encoding: Encoding of the code, see source_encoding
         :return:
         """
         root = tree.root_node
@@ -173,8 +169,175 @@ class MethodContentExtraction(ContentExtraction):
             if current.type != tree.root_node.type and len(current.children) == 0:
                 token, annotation = self._extract_token_annotation(code, current)
                 _, block_annotation = self._extract_token_annotation(code, parent)
-                tokens.append(Token(token.decode("utf8"), annotation, block_annotation, current.start_byte))
+                tokens.append(Token(token.decode(encoding), annotation, block_annotation, current.start_byte))
             for child in current.children:
                 stack.append((child, current))
 
         return tokens[::-1]
+
+
+class MultiViewContentExtraction(MethodContentExtraction):
+    """
+    Extracts the identifiers, the comments and the methods of each file with a single parse. The content of each
+    node is a dictionary with one entry per view. The identifiers and the comments are taken from the tree-sitter
+    tree instead of sourcy, see get_views.
+    """
+
+    identifier_types = {'identifier', 'type_identifier'}
+
+    def __init__(self, graph_path: str = None,
+                 repo_path: str = None, stopwords: Iterable = None, from_git: bool = False,
+                 parse_cache: str = None, parse_cache_size: int = 2048, languages_path: str = None,
+                 source_filter: SourceFilter = None, prefetch: int = 32):
+        super().__init__(graph_path, repo_path, stopwords, from_git, parse_cache, parse_cache_size, languages_path,
+                         source_filter, prefetch)
+        self.method = 'multi'
+
+    def get_content(self, project: str, graph: igraph.Graph):
+        """
+        Returns the content of files in the project.
+        :param project: Name of the project
+        :param graph: Graph of the project
+        :return:
+        """
+        self.prefetch_files(node['filePathRelative'] for node in graph.vs)
+        for node in graph.vs:
+            views = self.parse_source(node['filePathRelative'], self.get_views)
+            if views is None:
+                continue
+
+            yield node['filePathRelative'], views
+
+    def get_views(self, file_content: bytes):
+        """
+        Returns the identifiers, comments and methods from the content of the file. The identifiers are the
+        identifier and type_identifier leaves of the tree-sitter tree and the comments its comment leaves, not the
+        tokens returned by sourcy in IdentifiersContentExtraction and CommentsContentExtraction, so these views are
+        not guaranteed to match the content of the identifiers and comments methods. The methods are the same as
+        those of MethodContentExtraction.
+        :param file_content:
+        :return:
+        """
+        tree = self.parser.parse(file_content)
+        encoding = source_encoding(file_content)
+        tokens = self._traverse(file_content, tree, encoding)
+
+        ids = [self.split_camel(x.token) for x in tokens if x.annotation in self.identifier_types]
+        ids = [x.lower() for x in flatten(ids)
+               if x.lower() not in self.stopwords and len(x) > 1]
+
+        comments = [x.token.lower() for x in tokens if 'comment' in x.annotation]
+        comments = [x for x in comments if "license" not in x and "copyright" not in x]
+        comments = [x for x in flatten(re.findall(r'[^\W\d_]+', x) for x in comments)
+                    if x not in self.stopwords and len(x) > 1]
+
+        return {'identifiers': " ".join(ids),
+                'comments': " ".join(comments),
+                'methods': self._methods(file_content, tokens, encoding)}
+
+
+class QueryMethodContentExtraction(MethodContentExtraction):
+    """
+    Extracts the same methods as MethodContentExtraction without materializing the leaves of the syntax tree. A
+    tree-sitter query finds the method names, the braces of the blocks and the comments, and the token based scan of
+    _methods is replayed over these nodes only, slicing the bodies from the bytes of the file.
+    """
+
+    comment_types = ['comment', 'line_comment', 'block_comment']
+
+    def __init__(self, graph_path: str = None,
+                 repo_path: str = None, stopwords: Iterable = None, from_git: bool = False,
+                 parse_cache: str = None, parse_cache_size: int = 2048, languages_path: str = None,
+                 source_filter: SourceFilter = None, prefetch: int = 32):
+        super().__init__(graph_path, repo_path, stopwords, from_git, parse_cache, parse_cache_size, languages_path,
+                         source_filter, prefetch)
+        self.query = self.build_query(self.language)
+
+    @classmethod
+    def build_query(cls, language: tree_sitter.Language) -> tree_sitter.Query:
+        """
+        Builds the query of the nodes used by the scan, skipping the comment types missing in the grammar.
+        :param language:
+        :return:
+        """
+        patterns = ['(method_declaration (identifier) @name)', '(block "{" @open)', '(block "}" @close)']
+        for comment_type in cls.comment_types:
+            try:
+                language.query(f"({comment_type}) @comment")
+            except (NameError, SyntaxError, ValueError):
+                continue
+            patterns.append(f"({comment_type}) @comment")
+        return language.query("\n".join(patterns))
+
+    @staticmethod
+    def _next_leaf(node: Node) -> Optional[Node]:
+        """
+        Returns the leaf that follows the node in the file, or None if it is the last one.
+        """
+        while node is not None and node.next_sibling is None:
+            node = node.parent
+        if node is None:
+            return None
+        node = node.next_sibling
+        while node.child_count:
+            node = node.children[0]
+        return node
+
+    def get_methods(self, file_content: bytes):
+        """
+        Returns the methods from the content of the file. When the scan of _methods reads past the last token of
+        the file, which raises an IndexError there, the end of the file is used instead.
+        :param file_content:
+        :return:
+        """
+        tree = self.parser.parse(file_content)
+        encoding = source_encoding(file_content)
+        captures = [(node, kind) for node, kind in self.query.captures(tree.root_node) if not node.child_count]
+        captures.sort(key=lambda x: (x[0].start_byte, x[0].end_byte))
+
+        def next_start(node):
+            leaf = self._next_leaf(node)
+            return leaf.start_byte if leaf is not None else len(file_content)
+
+        methods = []
+        skip = None
+        i = 0
+        while i < len(captures):
+            name, kind = captures[i]
+            i += 1
+            if kind != 'name' or (name.start_byte, name.end_byte) == skip:
+                continue
+
+            comments = [name.start_byte]
+            open_blocks = 0
+            closed_blocks = 0
+            closed = False
+            while i < len(captures) and not closed:
+                node, kind = captures[i]
+                i += 1
+                if kind == 'comment':
+                    comments.extend([node.start_byte, next_start(node)])
+                elif kind == 'open':
+                    open_blocks += 1
+                elif kind == 'close':
+                    closed_blocks += 1
+                closed = open_blocks != 0 and open_blocks == closed_blocks
+
+            if closed:
+                # The scan ends at the token after the closing brace, which is then skipped
+                end = self._next_leaf(node)
+                end_byte = end.start_byte if end is not None else len(file_content)
+                skip = (end.start_byte, end.end_byte) if end is not None else None
+            else:
+                # The scan ends at the last token of the file
+                end = tree.root_node
+                while end.child_count:
+                    end = end.children[-1]
+                end_byte = end.start_byte
+
+            comments.append(end_byte)
+            pairs = list(zip(comments[::2], comments[1::2]))
+            body = ' '.join([file_content[s:e].decode(encoding) for s, e in pairs])
+            methods.append({'name': name.text.decode(encoding), 'body': ' '.join(body.split())})
+
+        return methods
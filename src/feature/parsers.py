@@ -0,0 +1,67 @@
+import os
+from functools import lru_cache
+from typing import Optional
+
+import tree_sitter
+from hydra import initialize, compose
+from tree_sitter import Parser
+
+_parsers = {}
+_languages_path = None
+
+
+def configure(languages_path: Optional[str]) -> None:
+    """
+    Sets the default shared library of the tree-sitter languages of the process.
+    :param languages_path: Path of the shared library
+    :return:
+    """
+    global _languages_path
+    _languages_path = languages_path
+
+
+@lru_cache(maxsize=None)
+def _config_languages_path() -> str:
+    # Dirty fix for loading the tree-sitter language file when no path is configured
+    with initialize(version_base=None, config_path="../../src/conf/"):
+        cfg = compose(config_name='annotation.yaml')
+    return f'{cfg.base_path}/languages.so'
+
+
+def languages_path(path: str = None) -> str:
+    """
+    Returns the shared library of the tree-sitter languages: the given one, the configured one, or `languages.so`
+    in the base path of the annotation config.
+    """
+    return path or _languages_path or _config_languages_path()
+
+
+@lru_cache(maxsize=None)
+def _load_language(path: str, name: str) -> tree_sitter.Language:
+    return tree_sitter.Language(path, name)
+
+
+def get_language(name: str = 'java', path: str = None) -> tree_sitter.Language:
+    """
+    Returns the language, loaded from the shared library once per process.
+    :param name: Name of the language
+    :param path: Path of the shared library, see languages_path
+    :return:
+    """
+    return _load_language(languages_path(path), name)
+
+
+def get_parser(name: str = 'java', path: str = None) -> Parser:
+    """
+    Returns the parser of the language, created once per process and shared by all the extractors.
+    :param name: Name of the language
+    :param path: Path of the shared library, see languages_path
+    :return:
+    """
+    path = languages_path(path)
+    key = (os.getpid(), path, name)
+    if key not in _parsers:
+        parser = Parser()
+        parser.set_language(_load_language(path, name))
+        _parsers[key] = parser
+    return _parsers[key]
@@ -0,0 +1,26 @@
+import hydra
+from hydra.utils import get_class
+from loguru import logger
+from omegaconf import DictConfig
+
+
+@hydra.main(config_path="../conf", config_name="annotation", version_base="1.2")
+def convert_word_vectors(cfg: DictConfig):
+    """
+    Converts the word vectors model of the embedding config to the native gensim format, memory mapped by the
+    embedding when loaded. Only needed once per model.
+    :param cfg:
+    :return:
+    """
+    embedding = get_class(cfg.embedding.cls._target_)
+    if not hasattr(embedding, 'convert'):
+        logger.error(f"{cfg.embedding.name} is not a word vectors model")
+        return
+
+    logger.info(f"Converting {cfg.embedding.cls.path}")
+    path = embedding.convert(cfg.embedding.cls.path)
+    logger.info(f"Saved {path}")
+
+
+if __name__ == '__main__':
+    convert_word_vectors()
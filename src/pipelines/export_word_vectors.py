@@ -0,0 +1,61 @@
+import ast
+from os.path import exists
+from pathlib import Path
+from typing import List
+
+import hydra
+import pandas as pd
+from loguru import logger
+from more_itertools import flatten
+from omegaconf import DictConfig
+
+from data.vocabulary import Vocabulary
+from feature.embedding import FastTextEmbedding, VocabularyFastTextEmbedding
+
+
+def annotation_tokens(cfg: DictConfig) -> List[str]:
+    """
+    Returns the tokens of the labels and of the keywords embedded by the annotations, see keyword_similarity and
+    SemanticSimilarityAnnotation, as they are and lowercased.
+    :param cfg:
+    :return:
+    """
+    texts = []
+    if exists(cfg.project_path):
+        projects = pd.read_csv(cfg.project_path)
+        if 'label' in projects:
+            texts.extend(flatten(projects['label'].apply(ast.literal_eval)))
+    if exists(cfg.keywords_dir):
+        for path in Path(cfg.keywords_dir).rglob('*.csv'):
+            texts.append(path.stem)
+            keywords = pd.read_csv(path, dtype={'keyword': str})
+            if 'keyword' in keywords:
+                texts.extend(str(x) for x in keywords['keyword'])
+
+    tokens = flatten(FastTextEmbedding.whitespace.split(str(x)) for x in texts)
+    return [x for x in dict.fromkeys(flatten((x, x.lower()) for x in tokens)) if x]
+
+
+@hydra.main(config_path="../conf", config_name="annotation", version_base="1.2")
+def export_word_vectors(cfg: DictConfig):
+    """
+    Exports the vectors of the tokens in the corpus vocabulary, and of the tokens of the labels and keywords, computed
+    with the fastText model of the embedding config, to the table used by VocabularyFastTextEmbedding. To be run
+    after the content and keywords extraction.
+    :param cfg:
+    :return:
+    """
+    if not cfg.vocabulary:
+        logger.error("The corpus vocabulary is not configured")
+        return
+
+    vocabulary = Vocabulary(cfg.vocabulary)
+    extra = annotation_tokens(cfg)
+    logger.info(f"Exporting {len(vocabulary)} tokens and {len(extra)} label and keyword tokens with "
+                f"{cfg.embedding.cls.path}")
+    n = VocabularyFastTextEmbedding.export(cfg.embedding.cls.path, vocabulary, cfg.vector_table, extra)
+    logger.info(f"Saved the vectors of {n} tokens in {cfg.vector_table}")
+
+
+if __name__ == '__main__':
+    export_word_vectors()
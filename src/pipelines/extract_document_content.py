@@ -1,52 +1,160 @@
-import json
 import os
 import traceback
-from os.path import join
+from collections import Counter
+from contextlib import ExitStack
+from multiprocessing import Pool
+from os.path import join, exists
+from pathlib import Path
+from typing import Tuple
 
 import hydra
 import pandas as pd
 from hydra.utils import instantiate
 from loguru import logger
 from omegaconf import DictConfig
+from tqdm import tqdm
 
+from data.content_store import ContentStore
+from data.diff import IncrementalState
+from data.manifest import VersionManifest
+from data.vocabulary import Vocabulary
+from feature import parsers
 from feature.content import ContentExtraction
 from utils import git_clone, get_versions, git_checkout
 
+_worker_extractor = None
+_worker_vocabulary = None
+_worker_cfg = None
+
+
+def completed_path(cfg: DictConfig, project_name: str) -> str:
+    """
+    Returns the path of the marker recording that the content of the project was extracted.
+    :param cfg:
+    :param project_name:
+    :return:
+    """
+    return join(cfg.content_dir, '.completed', project_name)
+
+
+def extract_project(cfg: DictConfig, content_extractor: ContentExtraction, project_name: str,
+                    vocabulary: Vocabulary = None) -> Tuple[str, int, int]:
+    """
+    Extracts the content of the versions of a project. The content is written to a temporary file that is moved to
+    the content file of the project, with its index, once all the versions are processed (see ContentStore), then
+    the project is marked as completed if no version failed. If the content config defines views, the content of
+    each view is written to the content file of the project in the folder of the view.
+    :param cfg:
+    :param content_extractor:
+    :param project_name:
+    :param vocabulary: If given, the bag-of-words of the textual content is written with the content files
+    :return: The project name, the number of versions extracted and the number of versions that failed
+    """
+    project = project_name.replace('|', '/')
+    if content_extractor.clone:
+        project_url = f'https://github.com/{project}'
+        git_clone(project_url, project_name, cfg.repositories_path)
+
+    versions = get_versions(project_name, cfg.arcan_graphs)
+    versions = versions if cfg.history else versions[-1:]
+    incremental = IncrementalState() if cfg.history else None
+    logger.info(f"Found {len(versions)} versions for {project_name}")
+
+    views = cfg.content.get('views')
+    if views:
+        stores = {view: ContentStore(path, cfg.compress_content) for view, path in views.items()}
+    else:
+        stores = {None: ContentStore(cfg.content_dir, cfg.compress_content)}
+
+    extracted, failed = 0, 0
+    with ExitStack() as stack:
+        writers = {view: stack.enter_context(store.writer(project_name, vocabulary)) for view, store in stores.items()}
+        for num, sha in versions:
+            try:
+                if content_extractor.clone and content_extractor.checkout:
+                    git_checkout(join(cfg.repositories_path, project_name), sha)
+                content = list(content_extractor.extract(project_name, sha, num, incremental=incremental))
+                if content_extractor.filtered:
+                    logger.debug(f"Skipped files in {project_name} {num}: "
+                                 f"{dict(Counter(content_extractor.filtered.values()))}")
+                for view, writer in writers.items():
+                    res = {x[0]: (x[1][view] if view else x[1]) for x in content}
+                    res = {k: v for k, v in res.items() if v}
+                    writer.write(project, num, sha, res, content_extractor.filtered)
+                extracted += 1
+            except Exception as e:
+                traceback.print_exc()
+                logger.error(f"Error in {project_name} {sha} {num}: {e}")
+                failed += 1
+                continue
+
+    if content_extractor.parse_cache is not None:
+        content_extractor.parse_cache.flush()
+        logger.info(f"Parse cache after {project_name}: {content_extractor.parse_cache}")
+
+    # Projects with failed versions are extracted again on resume
+    if failed == 0:
+        Path(completed_path(cfg, project_name)).touch()
+
+    return project_name, extracted, failed
+
+
+def init_worker(cfg: DictConfig) -> None:
+    """
+    Creates the content extractor and the vocabulary of the worker process, shared by all the projects it processes.
+    The tree-sitter languages of the process are loaded from the languages_path of the content config, if any.
+    :param cfg:
+    :return:
+    """
+    global _worker_extractor, _worker_vocabulary, _worker_cfg
+    _worker_cfg = cfg
+    parsers.configure(cfg.content.cls.get('languages_path'))
+    VersionManifest.configure(cfg.get('manifest_dir'))
+    _worker_extractor = instantiate(cfg.content.cls)
+    _worker_vocabulary = Vocabulary(cfg.vocabulary) if cfg.vocabulary else None
+
+
+def extract_project_worker(project_name: str) -> Tuple[str, int, int]:
+    try:
+        return extract_project(_worker_cfg, _worker_extractor, project_name, _worker_vocabulary)
+    except Exception as e:
+        traceback.print_exc()
+        logger.error(f"Error in {project_name}: {e}")
+        return project_name, 0, -1
+
 
 @hydra.main(config_path="../conf", config_name="annotation", version_base="1.2")
 def extract_content(cfg: DictConfig):
     """
+    Extracts the content of the projects. Projects already completed in a previous run are skipped, unless
+    force_new is set.
     :param cfg:
     :return:
     """
+    VersionManifest.configure(cfg.get('manifest_dir'))
+
+    projects = sorted(set(pd.read_csv(cfg.project_path)['name'].tolist()))
+
+    os.makedirs(join(cfg.content_dir, '.completed'), exist_ok=True)
+    for path in (cfg.content.get('views') or {}).values():
+        os.makedirs(path, exist_ok=True)
+    if not cfg.force_new:
+        done = [x for x in projects if exists(completed_path(cfg, x))]
+        projects = [x for x in projects if not exists(completed_path(cfg, x))]
+        logger.info(f"Skipping {len(done)} projects already extracted")
+
+    if cfg.num_workers > 1:
+        logger.info(f"Using {cfg.num_workers} workers")
+        with Pool(cfg.num_workers, initializer=init_worker, initargs=(cfg,)) as p:
+            results = list(tqdm(p.imap_unordered(extract_project_worker, projects), total=len(projects)))
+    else:
+        init_worker(cfg)
+        results = [extract_project_worker(project_name) for project_name in tqdm(projects)]
 
-    projects = list(set(pd.read_csv(cfg.project_path)['name'].tolist()))
-    content_extractor: ContentExtraction = instantiate(cfg.content.cls)
-
-    os.makedirs(cfg.content_dir, exist_ok=True)
-    for project_name in projects:
-        project = project_name.replace('|', '/')
-        if content_extractor.clone:
-            project_url = f'https://github.com/{project}'
-            git_clone(project_url, project_name, cfg.repositories_path)
-
-        versions = [get_versions(project_name, cfg.arcan_graphs)[-1]]
-        logger.info(f"Found {len(versions)} versions for {project_name}")
-
-        with open(f"{cfg.content_dir}/{project_name}.json", 'wt') as f:
-            for num, sha in versions:
-                try:
-                    if content_extractor.clone:
-                        git_checkout(join(cfg.repositories_path, project_name), sha)
-                    content = list(content_extractor.extract(project_name, sha, num))
-                    res = {x[0]: x[1] for x in content if x[1]}
-                    content = {"project": project, "num": num, "sha": sha, "content": res}
-                    row = json.dumps(content, ensure_ascii=False)
-                    f.write(row + os.linesep)
-                except Exception as e:
-                    traceback.print_exc()
-                    logger.error(f"Error in {project_name} {sha} {num}: {e}")
-                    continue
+    failed_projects = [x[0] for x in results if x[2] < 0]
+    failed_versions = sum(x[2] for x in results if x[2] > 0)
+    logger.info(f"Extracted {sum(x[1] for x in results)} versions of {len(results) - len(failed_projects)} projects")
+    logger.info(f"Failed {len(failed_projects)} projects and {failed_versions} versions")
 
 
 if __name__ == '__main__':
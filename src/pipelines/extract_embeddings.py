@@ -7,7 +7,9 @@ from hydra.utils import instantiate
 from loguru import logger
 from omegaconf import DictConfig
 
-from feature.embedding import AbstractEmbeddingModel
+from data.diff import IncrementalState
+from data.manifest import VersionManifest
+from feature.embedding import AbstractEmbeddingModel, CachedEmbedding, cached_embedding
 from feature.extract import FeatureExtraction
 from utils import git_clone, get_versions, git_checkout
 
@@ -18,7 +20,9 @@ def extract_embeddings(cfg: DictConfig):
     :param cfg:
     :return:
     """
-    embedding: AbstractEmbeddingModel = instantiate(cfg.embedding.cls)
+    VersionManifest.configure(cfg.get('manifest_dir'))
+    embedding: AbstractEmbeddingModel = cached_embedding(instantiate(cfg.embedding.cls), cfg.embedding_cache,
+                                                         cfg.embedding_cache_size)
 
     extraction: FeatureExtraction = instantiate(cfg.extraction.cls, model=embedding)
 
@@ -38,24 +42,32 @@ def extract_embeddings(cfg: DictConfig):
             project_url = f'https://github.com/{project}'
             git_clone(project_url, project_name, cfg.repositories_path)
         try:
-            versions = [get_versions(project_name, cfg.arcan_graphs)[-1]]
+            versions = get_versions(project_name, cfg.arcan_graphs)
+            versions = versions if cfg.history else [versions[-1]]
         except:
             logger.error(f"Failed to extract features for {project} {num} {sha}")
             logger.error(f"{e}")
             continue
 
         logger.info(f"Found {len(versions)} versions for project {project}")
+        incremental = IncrementalState(result_key=extraction.result_key) if cfg.history else None
         for num, sha in versions:
             try:
-                if extraction.clone:
+                if extraction.clone and extraction.checkout:
                     git_checkout(join(cfg.repositories_path, project_name), sha)
-                extraction.extract(project_name, sha=sha, num=num)
+                extraction.extract(project_name, sha=sha, num=num, incremental=incremental)
             except Exception as e:
                 traceback.print_exc()
                 logger.error(f"Failed to extract features for {project} {num} {sha}")
                 logger.error(f"{e}")
                 continue
 
+        if isinstance(embedding, CachedEmbedding):
+            logger.info(f"Embedding cache after {project}: {embedding.cache}")
+
+    if isinstance(embedding, CachedEmbedding):
+        embedding.close()
+
 
 if __name__ == '__main__':
     extract_embeddings()
@@ -1,6 +1,5 @@
 import ast
 import csv
-import json
 from collections import Counter, defaultdict
 from os import makedirs
 from os.path import join
@@ -13,6 +12,8 @@ from more_itertools import flatten
 from omegaconf import DictConfig
 from tqdm import tqdm
 
+from data.content_store import ContentStore
+from data.vocabulary import Vocabulary
 from feature.keyword_extraction import AbstractKeywordExtraction
 from utils import filter_by_label
 
@@ -38,21 +39,31 @@ def extract_keywords(projects, cfg):
 
 def extract_kw(cfg, project_name):
     kw_extractor: AbstractKeywordExtraction = instantiate(cfg.keyword.cls)
-    content = load_content(join(cfg.content_dir, f"{project_name}.json"))
+    store = ContentStore(cfg.content_dir)
+    content = load_content(store, project_name)
     text = " ".join(content)
-    tokens = text.split(" ")
     keywords = [x[0] for x in kw_extractor.get_keywords(text)]
-    content_count = Counter(tokens)
+    content_count = term_counts(cfg, store, project_name, text)
     return project_name, content_count, keywords
 
 
-def load_content(content_path):
+def term_counts(cfg, store: ContentStore, project_name: str, text: str) -> Counter:
+    """
+    Counts the terms of the project, from the bag-of-words stored with the content if available, otherwise by
+    splitting the text.
+    """
+    bow = store.bag_of_words(project_name) if cfg.vocabulary else None
+    if bow is None:
+        return Counter(text.split(" "))
+
+    ids, counts = bow.term_counts()
+    return Counter(dict(zip(Vocabulary(cfg.vocabulary).tokens(ids), counts.tolist())))
+
+
+def load_content(store: ContentStore, project_name: str):
     content = []
-    with open(content_path, 'r') as f:
-        for line in f:
-            obj = json.loads(line)
-            for filename in obj['content']:
-                content.append(obj["content"][filename])
+    for obj in store.records(project_name):
+        content.extend(obj['content'].values())
     return content
 
 
@@ -5,12 +5,13 @@ from os.path import join
 import hydra
 import pandas as pd
 from hydra.utils import instantiate
+from loguru import logger
 from more_itertools import flatten
 from omegaconf import DictConfig
 from sklearn.metrics.pairwise import cosine_similarity
 from tqdm import tqdm
 
-from feature.embedding import AbstractEmbeddingModel
+from feature.embedding import AbstractEmbeddingModel, CachedEmbedding, cached_embedding
 
 
 @hydra.main(config_path="../conf", config_name="annotation", version_base="1.2")
@@ -24,7 +25,8 @@ def keyword_similarity(cfg: DictConfig):
 
     labels = projects['label'].apply(ast.literal_eval).apply(tuple).tolist()
     labels = list(set(flatten(labels)))
-    embedding_model: AbstractEmbeddingModel = instantiate(cfg.embedding.cls)
+    embedding_model: AbstractEmbeddingModel = cached_embedding(instantiate(cfg.embedding.cls), cfg.embedding_cache,
+                                                               cfg.embedding_cache_size)
 
     for label in tqdm(labels):
         try:
@@ -35,18 +37,20 @@ def keyword_similarity(cfg: DictConfig):
         except:
             continue
 
-        similarities = []
         label_emb = [embedding_model.get_embedding(label)]
-        for i, key in enumerate(keywords_df['keyword']):
-            tokvecs = [embedding_model.get_embedding(str(key))]
-            sim = cosine_similarity(tokvecs, label_emb)[0][0]
-            similarities.append(sim)
+        tokvecs = embedding_model.get_embeddings([str(key) for key in keywords_df['keyword']],
+                                                 cfg.embedding_batch_size)
+        similarities = cosine_similarity(tokvecs, label_emb)[:, 0] if len(tokvecs) else []
 
         keywords_df[f'{embedding_model.name}'] = similarities
         out_path = f"{cfg.keywords_dir}/similarity/"
         os.makedirs(out_path, exist_ok=True)
         keywords_df.to_csv(os.path.join(out_path, f"{label}.csv"), index=False)
 
+    if isinstance(embedding_model, CachedEmbedding):
+        logger.info(f"Embedding cache: {embedding_model.cache}")
+        embedding_model.close()
+
 
 if __name__ == '__main__':
     keyword_similarity()
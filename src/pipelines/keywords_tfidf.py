@@ -4,11 +4,12 @@ from pathlib import Path
 import hydra
 import numpy as np
 import pandas as pd
-from gensim import corpora, models
+from gensim import models
 from loguru import logger
-from more_itertools import flatten
 from omegaconf import DictConfig
 
+from data.vocabulary import Vocabulary
+
 
 @hydra.main(config_path="../conf", config_name="annotation", version_base="1.2")
 def keywords_tfidf(cfg: DictConfig):
@@ -16,7 +17,7 @@ def keywords_tfidf(cfg: DictConfig):
 
     keywords_files = list(keywords_path.glob("*.csv"))
     labels = []
-    doc_tokenized = []
+    docs = []
     for keywords_file in keywords_files:
         label = keywords_file.stem
         labels.append(label)
@@ -27,18 +28,23 @@ def keywords_tfidf(cfg: DictConfig):
             pass
         terms = df.values.tolist()
 
-        doc_tokenized.append(list(flatten([[str(term)] * n for term, _, n in terms])))
+        docs.append([(str(term), n) for term, _, n in terms if n > 0])
 
     logger.info(f"Creating dictionary")
-    dictionary = corpora.Dictionary()
-    BoW_corpus = [dictionary.doc2bow(doc, allow_update=True) for doc in doc_tokenized]
+    vocabulary = Vocabulary()
+    BoW_corpus = []
+    for doc in docs:
+        ids = vocabulary.add(term for term, _ in doc)
+        counts = np.bincount(ids, weights=[n for _, n in doc]) if len(ids) else np.zeros(0)
+        BoW_corpus.append([(int(x), int(counts[x])) for x in np.flatnonzero(counts)])
 
     logger.info(f"Creating TF-IDF model")
     tfidf = models.TfidfModel(BoW_corpus, smartirs='ntc')
 
     label_terms_tfidf = []
     for doc in tfidf[BoW_corpus]:
-        label_terms_tfidf.append({dictionary[id]: np.around(freq, decimals=2) for id, freq in doc})
+        terms = vocabulary.tokens(id for id, _ in doc)
+        label_terms_tfidf.append({term: np.around(freq, decimals=2) for term, (_, freq) in zip(terms, doc)})
 
     for i, keywords_file in enumerate(keywords_files):
         label = keywords_file.stem
@@ -1,5 +1,6 @@
 import json
 import traceback
+from collections import Counter
 from os.path import join
 from pathlib import Path
 
@@ -10,6 +11,8 @@ from loguru import logger
 from omegaconf import DictConfig
 from tqdm import tqdm
 
+from data.diff import carry_forward_labels
+from data.manifest import VersionManifest
 from feature.content import JSONContentExtraction
 from utils import git_clone, get_versions, git_checkout
 
@@ -20,6 +23,7 @@ def node_annotation(cfg: DictConfig):
     :param cfg:
     :return:
     """
+    VersionManifest.configure(cfg.get('manifest_dir'))
     content_extractor = JSONContentExtraction(cfg.content_dir)
 
     projects = pd.read_csv(cfg.dataset)
@@ -40,38 +44,46 @@ def node_annotation(cfg: DictConfig):
             project_url = f'https://github.com/{project}'
             git_clone(project_url, project_name, cfg.repositories_path)
 
-        try:
-            num, sha = get_versions(project_name, cfg.arcan_graphs)[-1]
-        except IndexError:
+        versions = get_versions(project_name, cfg.arcan_graphs)
+        if not versions:
             logger.warning(f"Could not find a version for {project}")
             continue
 
-        try:
-            pname = f"{project_name}-{num}-{sha}"
+        previous = None
+        for num, sha in (versions if cfg.history else versions[-1:]):
+            try:
+                pname = f"{project_name}-{num}-{sha}"
 
-            if content_extractor.clone:
-                git_checkout(join(cfg.repositories_path, project_name), sha)
+                if content_extractor.clone and content_extractor.checkout:
+                    git_checkout(join(cfg.repositories_path, project_name), sha)
 
-            project_content = dict(content_extractor.extract(project_name, sha, num))
-            labels = compute_node_labels(project_content, annotation, transformation, filtering)
+                project_content = dict(content_extractor.extract(project_name, sha, num))
+                skipped = content_extractor.skipped(project_name, sha)
+                if skipped:
+                    logger.info(f"Files without content in {pname}: {dict(Counter(skipped.values()))}")
+                labels = compute_node_labels(project_content, annotation, transformation, filtering, previous)
+                previous = (project_content, labels)
 
-            out_path = Path(join(cfg.annotations_path, f"{pname}.json"))
-            out_path.parent.mkdir(parents=True, exist_ok=True)
+                out_path = Path(join(cfg.annotations_path, f"{pname}.json"))
+                out_path.parent.mkdir(parents=True, exist_ok=True)
 
-            with open(out_path, 'w') as f:
-                json.dump(labels, f, ensure_ascii=False)
+                with open(out_path, 'w') as f:
+                    json.dump(labels, f, ensure_ascii=False)
 
-        except Exception as e:
-            traceback.print_exc()
-            logger.error(f"Failed to extract features for {project} {num} {sha}")
-            logger.error(f"{e}")
-            continue
+            except Exception as e:
+                traceback.print_exc()
+                logger.error(f"Failed to extract features for {project} {num} {sha}")
+                logger.error(f"{e}")
+                continue
 
 
-def compute_node_labels(contents, annotation, transform, filtering):
-    node_labels = {}
-    for node, content in contents.items():
-        vec = annotation.annotate(node, content)
+def compute_node_labels(contents, annotation, transform, filtering, previous=None):
+    """
+    Annotates the nodes. If the content and labels of the previous version are given, the labels of the nodes
+    whose content did not change are carried forward.
+    """
+    node_labels, contents = carry_forward_labels(contents, previous)
+    for node, vec in annotation.annotate_all(contents).items():
         unannotated = 0
 
         if filtering:
@@ -16,7 +16,8 @@ from omegaconf import DictConfig
 from scipy.spatial.distance import jensenshannon
 from tqdm import tqdm
 
-from data.graph import ArcanGraphLoader
+from data.manifest import VersionManifest
+from data.membership import MembershipIndex
 from utils import get_versions
 
 
@@ -28,16 +29,7 @@ def load_annotations(annotations_path):
 
 
 def load_package_file(graph, annotations):
-    nodes_id = [x for x in graph.vs if x['filePathRelative'] in annotations if
-                graph.vs[x.index]['filePathRelative'] != '.']
-    package_files = defaultdict(list)
-    for node in nodes_id:
-        packages = [graph.vs[x]['name'] for x in graph.neighbors(node.index) if
-                    graph.vs[x]['labelV'] == 'container']
-        for package in packages:
-            package_files[package].append(graph.vs[node.index]['filePathRelative'])
-
-    return package_files
+    return MembershipIndex.from_graph(graph).package_files(annotations)
 
 
 def annotate(annotations, package_files_map):
@@ -150,6 +142,7 @@ def package_jsd(package_annotations):
 
 @hydra.main(config_path="../conf", config_name="annotation", version_base="1.3")
 def package_annotation(cfg: DictConfig):
+    VersionManifest.configure(cfg.get('manifest_dir'))
     projects = pd.read_csv(cfg.dataset)
 
     projects = projects[projects['language'].str.upper() == cfg.language.upper()]
@@ -173,9 +166,9 @@ def package_annotation(cfg: DictConfig):
                     skipped += 1
                     continue
 
-                graph = ArcanGraphLoader().load(
+                membership = MembershipIndex.load_or_build(
                     join(cfg.arcan_graphs, project_name, f"dependency-graph-{num}_{sha}.graphml"))
-                package_files_map = load_package_file(graph, annotations)
+                package_files_map = membership.package_files(annotations)
                 package_annotations = annotate(annotations, package_files_map)
 
                 # res = {'project': project_name, 'num': num, 'sha': sha, 'packages': package_annotation}
@@ -13,6 +13,7 @@ from omegaconf import DictConfig
 from scipy.spatial.distance import jensenshannon
 from tqdm import tqdm
 
+from data.manifest import VersionManifest
 from utils import get_versions
 
 
@@ -35,6 +36,7 @@ def projects_level_labels(annotations_path):
 
 @hydra.main(config_path="../conf", config_name="annotation", version_base="1.3")
 def annotate_project(cfg: DictConfig):
+    VersionManifest.configure(cfg.get('manifest_dir'))
     projects = pd.read_csv(cfg.dataset)
 
     projects = projects[projects['language'].str.upper() == cfg.language.upper()]
@@ -0,0 +1,49 @@
+from pathlib import Path
+
+import hydra
+from loguru import logger
+from omegaconf import DictConfig
+from tqdm import tqdm
+
+from data.graph import ArcanGraphLoader
+
+
+def warm_graph(path: str) -> int:
+    """
+    Converts a graph in the binary cache for both the raw and the cleaned profile.
+    :param path: Path of the GraphML file
+    :return: Number of profiles that had to be converted
+    """
+    converted = 0
+    for clean in [False, True]:
+        try:
+            converted += ArcanGraphLoader(clean=clean).warm(path)
+        except Exception as e:
+            logger.error(f"Failed to cache {path}: {e}")
+
+    return converted
+
+
+@hydra.main(config_path="../conf", config_name="main", version_base="1.2")
+def warm_graph_cache(cfg: DictConfig):
+    """
+    Converts all the Arcan graphs in the binary graph cache.
+    :param cfg:
+    :return:
+    """
+    graphs = sorted(str(x) for x in Path(cfg.arcan_graphs).glob('*/*.graphml'))
+    logger.info(f"Warming the graph cache for {len(graphs)} graphs")
+
+    if cfg.num_workers > 1:
+        logger.info(f"Using {cfg.num_workers} workers")
+        from multiprocessing import Pool
+        with Pool(cfg.num_workers) as p:
+            converted = sum(tqdm(p.imap_unordered(warm_graph, graphs), total=len(graphs)))
+    else:
+        converted = sum(warm_graph(graph) for graph in tqdm(graphs))
+
+    logger.info(f"Converted {converted} graph profiles")
+
+
+if __name__ == '__main__':
+    warm_graph_cache()
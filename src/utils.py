@@ -1,9 +1,10 @@
 import ast
 import glob
 import os
+import sqlite3
 from collections import Counter
 from os.path import basename, join
-from subprocess import call
+from subprocess import call, check_output, CalledProcessError
 from typing import Tuple, List, Dict
 
 import igraph
@@ -12,6 +13,9 @@ from loguru import logger
 from more_itertools import flatten
 from sklearn import preprocessing
 
+from data.graph import GraphView
+from data.manifest import VersionManifest
+
 
 def check_dir(path: str) -> None:
     """
@@ -54,14 +58,45 @@ def git_checkout(repo_path: str, sha: str) -> None:
     return
 
 
+def git_blob_hashes(repo_path: str, sha: str) -> Dict[str, str]:
+    """
+    Returns the blob hash of each file in a version of the repository, without checking it out.
+    :param repo_path: Path of the repository
+    :param sha: Version of the repository
+    :return: Map from the path of the file, relative to the repository root, to its blob hash
+    """
+    try:
+        out = check_output(["git", "ls-tree", "-r", "-z", sha], cwd=repo_path)
+    except (CalledProcessError, OSError) as e:
+        logger.warning(f"Could not list the files of {repo_path} at {sha}: {e}")
+        return {}
+
+    res = {}
+    for entry in out.decode("utf8", errors="surrogateescape").split("\0"):
+        if not entry:
+            continue
+        meta, path = entry.split("\t", 1)
+        _, kind, blob = meta.split()
+        if kind == "blob":
+            res[path] = blob
+    return res
+
+
 def get_versions(project: str, arcan_out: str) -> List[Tuple[str, str]]:
     """
     Returns a list of tuples (version, sha) for a project. The version, is the number of the commit in the git history.
+    The versions are read from the version manifest of the Arcan output folder, the folder is listed only if the
+    manifest cannot be used.
     :param project: Project name
     :param arcan_out: Arcan output folder
     :return:
     """
-    files = [basename(x) for x in glob.glob(join(arcan_out, project, "*"))]
+    try:
+        return VersionManifest.get(arcan_out).versions(project)
+    except sqlite3.Error as e:
+        logger.warning(f"Could not use the version manifest in {arcan_out}: {e}")
+
+    files = [basename(x) for x in glob.glob(join(arcan_out, project, "*.graphml"))]
     res = []
     for file in files:
         num, sha = file.replace('.graphml', '').split("-")[-1].split("_")
@@ -117,12 +152,10 @@ def node_package_mapping(graph: igraph.Graph) -> Dict[str, str]:
     :param graph:
     :return:
     """
-    res = {}
-    for edge in graph.es:
-        v1, v2 = edge.source, edge.target
-        if v1['labelV'] == 'container':
-            res[v1['filePathRelative']] = v2['filePathRelative']
-    return res
+    view = GraphView(graph)
+    paths = view.vertex('filePathRelative')
+    containers = (view.vertex('labelV') == 'container')[view.source]
+    return dict(zip(paths[view.source[containers]].tolist(), paths[view.target[containers]].tolist()))
 
 
 def parse_settings(settings):